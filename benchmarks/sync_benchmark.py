@@ -0,0 +1,220 @@
+"""
+音声同期 (sync_audio.find_audio_offset) の速度と精度を測るベンチマーク。
+
+オフセットが既知の合成録音 (haystack / needle の組) をオフラインで生成し、
+ケースごとに別プロセスで同期を実行して、処理時間・ピークメモリ (RSS)・オフセット誤差を表示する。
+
+    uv run benchmarks/sync_benchmark.py                       # 10分〜4時間の全ケース
+    uv run benchmarks/sync_benchmark.py --durations 10 30      # 録音の長さ (分) を指定
+    uv run benchmarks/sync_benchmark.py --mode full --json result.json
+
+生成した WAV は --work-dir (既定: 一時ディレクトリ下の cvcutter_sync_benchmark) に保存され、次回以降は再利用される。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+HAYSTACK_SAMPLE_RATE = 48000   # マイク録音 (フィールドレコーダー) のレート
+NEEDLE_SAMPLE_RATE = 44100     # 動画の音声トラックのレート。わざと haystack とずらす
+SYNC_SAMPLE_RATE = 22050       # process_pair の audio_sync_sample_rate の既定値
+NEEDLE_SECONDS = 300           # 1曲分の長さ
+BLOCK_SECONDS = 30             # WAV を生成するブロックの長さ
+SCHEDULE_VERSION = 1           # 生成方法を変えたら上げて、古い WAV を使わないようにする
+
+SCENARIOS = {
+    # 名前: (needle の残響, needle の SNR (dB), needle のゲイン (dB), needle の先頭に含める無音の秒数)
+    'clean': (False, None, 0.0, 0),
+    'reverb_noise_gain': (True, 10.0, -12.0, 0),
+    'after_silence': (True, 15.0, 6.0, 90),
+}
+
+def make_schedule(duration, seed):
+    """
+    ピアノ風の音符 (開始秒, 周波数, 音量, 減衰率) の配列を作る。
+    約20分ごとに2〜5分の無音 (休憩・転換) を挟む。無音区間のリストも返す。
+    """
+    rng = np.random.default_rng(seed)
+    notes = []
+    silences = []
+    t = 1.0
+    next_break = rng.uniform(15, 25) * 60
+    while t < duration:
+        if t >= next_break:
+            length = rng.uniform(120, 300)
+            silences.append((t, t + length))
+            t += length
+            next_break = t + rng.uniform(15, 25) * 60
+            continue
+        for _ in range(rng.integers(1, 4)):
+            notes.append((t, 440.0 * 2 ** (rng.integers(-30, 28) / 12), rng.uniform(0.1, 0.5), rng.uniform(1.5, 5)))
+        t += rng.uniform(0.08, 0.6)
+    return np.array(notes, dtype=np.float64).reshape(-1, 4), silences
+
+def render(schedule, start, duration, sr):
+    """schedule の音符を start 秒から duration 秒だけ、倍音と指数減衰つきの正弦波で合成する"""
+    n = int(round(duration * sr))
+    out = np.zeros(n, dtype=np.float64)
+    note_seconds = 3.0
+    first, last = np.searchsorted(schedule[:, 0], [start - note_seconds, start + duration])
+    for onset, freq, amp, decay in schedule[first:last]:
+        begin = int(round((onset - start) * sr))
+        lo, hi = max(0, begin), min(n, begin + int(note_seconds * sr))
+        if lo >= hi:
+            continue
+        t = (np.arange(lo, hi) - begin) / sr
+        phase = 2 * np.pi * freq * t
+        tone = np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)
+        out[lo:hi] += amp * tone * np.exp(-decay * t) * np.minimum(1.0, t / 0.005)
+    return out
+
+def reverb(audio, sr, seed):
+    """直接音と残響のエネルギーが同程度の、0.4秒で減衰するインパルス応答を畳み込む"""
+    from scipy.signal import fftconvolve
+    rng = np.random.default_rng(seed)
+    length = int(0.4 * sr)
+    ir = rng.standard_normal(length) * np.exp(-np.arange(length) / sr * 12)
+    ir[0] = np.sqrt(np.sum(ir[1:] ** 2))
+    return fftconvolve(audio, ir / ir[0])[:len(audio)] / 2
+
+def write_wav(path, blocks, sr):
+    """float のブロック列を 16bit mono の WAV としてストリーミングで書き出す"""
+    tmp_path = f"{path}.tmp"
+    with wave.open(tmp_path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        for block in blocks:
+            f.writeframes((np.clip(block, -1, 1) * 32767).astype('<i2').tobytes())
+    os.replace(tmp_path, path)
+
+def prepare_case(work_dir, minutes, scenario, seed):
+    """haystack と needle の WAV を (なければ) 生成し、ケースの情報を返す"""
+    duration = minutes * 60.0
+    schedule, silences = make_schedule(duration, seed)
+    with_reverb, snr_db, gain_db, lead_silence = SCENARIOS[scenario]
+
+    # needle の開始位置: 無音の後に始まるケースでは、休憩明けの lead_silence 秒前から切り出す
+    offset = duration * 0.37
+    later_silences = [end for _, end in silences if end + NEEDLE_SECONDS < duration]
+    if lead_silence and later_silences:
+        offset = later_silences[len(later_silences) // 2] - lead_silence
+    offset = round(min(offset, duration - NEEDLE_SECONDS - 1), 3)
+
+    haystack_path = os.path.join(work_dir, f"haystack_{minutes:g}min_seed{seed}_v{SCHEDULE_VERSION}.wav")
+    if not os.path.exists(haystack_path):
+        rng = np.random.default_rng(seed + 1)
+        def haystack_blocks():
+            for block_start in np.arange(0, duration, BLOCK_SECONDS):
+                length = min(BLOCK_SECONDS, duration - block_start)
+                block = 0.3 * render(schedule, block_start, length, HAYSTACK_SAMPLE_RATE)
+                yield block + 0.002 * rng.standard_normal(len(block))
+        write_wav(haystack_path, haystack_blocks(), HAYSTACK_SAMPLE_RATE)
+
+    needle_path = os.path.join(work_dir, f"needle_{minutes:g}min_seed{seed}_{scenario}_v{SCHEDULE_VERSION}.wav")
+    if not os.path.exists(needle_path):
+        rng = np.random.default_rng(seed + 2)
+        needle = 0.3 * render(schedule, offset, NEEDLE_SECONDS, NEEDLE_SAMPLE_RATE)
+        if with_reverb:
+            needle = reverb(needle, NEEDLE_SAMPLE_RATE, seed + 3)
+        if snr_db is not None:
+            noise_rms = np.sqrt(np.mean(needle ** 2)) / 10 ** (snr_db / 20)
+            needle = needle + noise_rms * rng.standard_normal(len(needle))
+        write_wav(needle_path, [needle * 10 ** (gain_db / 20)], NEEDLE_SAMPLE_RATE)
+
+    return {'minutes': minutes, 'scenario': scenario, 'haystack': haystack_path,
+            'needle': needle_path, 'true_offset': offset}
+
+def peak_rss_mb():
+    """このプロセスのピークメモリ (MB)。resource モジュールのない環境では None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_case(case, mode):
+    """子プロセス側: 1ケースの同期を実行し、結果を JSON で標準出力に書く"""
+    from cvcutter.sync_audio import AudioSyncSession, find_audio_offset
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        session = AudioSyncSession(case['haystack'], SYNC_SAMPLE_RATE,
+                                   hierarchical=(mode != 'full'), streaming=(mode != 'in-memory'))
+        setup_seconds = time.perf_counter() - start
+        result = find_audio_offset(case['haystack'], case['needle'], SYNC_SAMPLE_RATE, session=session)
+        session.close()
+    wall_seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        'wall_seconds': wall_seconds,
+        'setup_seconds': setup_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'offset_seconds': result['offset_seconds'] if result else None,
+        'confidence': result.get('confidence') if result else None,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="音声同期の速度と精度を合成録音で測定します。")
+    parser.add_argument('--durations', type=float, nargs='+', default=[10, 30, 60, 120, 240],
+                        help="haystack の長さ (分)")
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS),
+                        help="needle の劣化のさせ方")
+    parser.add_argument('--mode', choices=['hierarchical', 'full', 'in-memory'], default='hierarchical',
+                        help="hierarchical: 粗密探索 (既定) / full: overlap-save による全域探索 / "
+                             "in-memory: librosa で haystack 全体をメモリに読み込む従来方式")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'cvcutter_sync_benchmark'))
+    parser.add_argument('--json', help="結果を書き出す JSON ファイル")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        run_case(json.loads(args.run_case), args.mode)
+        return
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = []
+    print(f"{'長さ':>8} {'シナリオ':<18} {'時間(s)':>8} {'準備(s)':>8} {'RSS(MB)':>8} {'誤差(ms)':>9} {'PSR':>6}")
+    for minutes in args.durations:
+        for scenario in args.scenarios:
+            case = prepare_case(args.work_dir, minutes, scenario, args.seed)
+            # ピークメモリをケースごとに測るため、同期は毎回新しいプロセスで実行する
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--mode', args.mode, '--run-case', json.dumps(case)],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if completed.returncode != 0:
+                print(f"{minutes:>6g}分 {scenario:<18} 失敗: {completed.stderr.strip().splitlines()[-1:]}")
+                continue
+            measured = json.loads(completed.stdout.strip().splitlines()[-1])
+            error_ms = None
+            if measured['offset_seconds'] is not None:
+                error_ms = (measured['offset_seconds'] - case['true_offset']) * 1000
+            results.append(dict(case, mode=args.mode, error_ms=error_ms, **measured))
+
+            rss = f"{measured['peak_rss_mb']:.0f}" if measured['peak_rss_mb'] is not None else 'n/a'
+            error = f"{error_ms:.1f}" if error_ms is not None else '失敗'
+            confidence = f"{measured['confidence']:.1f}" if measured['confidence'] is not None else '-'
+            print(f"{minutes:>6g}分 {scenario:<18} {measured['wall_seconds']:>8.2f} {measured['setup_seconds']:>8.2f} "
+                  f"{rss:>8} {error:>9} {confidence:>6}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4, ensure_ascii=False)
+        print(f"結果を {args.json} に保存しました。")
+
+if __name__ == '__main__':
+    main()
@@ -43,6 +43,9 @@ def build():
         '--hidden-import=cvcutter.pdf_parser',
         '--hidden-import=cvcutter.video_utils',
         '--hidden-import=cvcutter.detect_performances',
+        '--hidden-import=cvcutter.frame_source',
+        '--hidden-import=cvcutter.motion_timeline',
+        '--hidden-import=cvcutter.audio_prepass',
         '--hidden-import=cvcutter.sync_audio',
         '--hidden-import=cvcutter.youtube_uploader',
     ])
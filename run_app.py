@@ -1,5 +1,6 @@
 import sys
 import os
+import multiprocessing
 from pathlib import Path
 
 # exe内部または実行環境のパスを調整
@@ -16,4 +17,6 @@ sys.path.insert(0, str(base_path))
 from cvcutter.app import main
 
 if __name__ == "__main__":
+    # exe化した環境で並列処理用の子プロセスを起動できるようにする
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
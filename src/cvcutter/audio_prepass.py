@@ -0,0 +1,95 @@
+import numpy as np
+from .video_utils import iter_audio_blocks
+
+PREPASS_SAMPLE_RATE = 8000
+FRAME_SECONDS = 0.1
+
+def compute_audio_envelope(video_path, sample_rate=PREPASS_SAMPLE_RATE, frame_seconds=FRAME_SECONDS):
+    """
+    動画の音声トラックを低レートでストリーミングデコードし、frame_seconds ごとの
+    RMS (dB) とスペクトル平坦度を返す。拍手はノイズ的で平坦度が高く、ピアノの演奏は低い。
+    """
+    frame_size = int(sample_rate * frame_seconds)
+    window = np.hanning(frame_size).astype(np.float32)
+    levels = []
+    flatness = []
+    remainder = np.zeros(0, dtype=np.float32)
+    for block in iter_audio_blocks(video_path, sample_rate, frame_size * 600):
+        block = np.concatenate([remainder, block])
+        n_frames = len(block) // frame_size
+        remainder = block[n_frames * frame_size:]
+        if n_frames == 0:
+            continue
+        frames = block[:n_frames * frame_size].reshape(n_frames, frame_size)
+
+        rms = np.sqrt(np.mean(frames.astype(np.float64) ** 2, axis=1))
+        levels.append(20 * np.log10(rms + 1e-10))
+
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 + 1e-12
+        flatness.append(np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1))
+
+    if not levels:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(levels), np.concatenate(flatness)
+
+def _runs(mask):
+    """真偽値配列の True が連続する区間を (開始, 終了) のリストで返す"""
+    padded = np.concatenate([[False], mask, [False]]).astype(np.int8)
+    changes = np.flatnonzero(np.diff(padded))
+    return list(zip(changes[0::2].tolist(), changes[1::2].tolist()))
+
+def prepass_parameters(config):
+    """解析する時間帯を左右する事前解析のパラメータ (特徴量タイムラインのキー用)"""
+    return {
+        'level_db': config.get('audio_prepass_level_db', 12),
+        'flatness': config.get('audio_prepass_flatness', 0.25),
+        'smoothing_seconds': config.get('audio_prepass_smoothing_seconds', 5),
+        'padding_seconds': config.get('audio_prepass_padding_seconds', 45),
+        'min_duration_seconds': config['min_duration_seconds'],
+    }
+
+def find_candidate_windows(video_path, config, duration_seconds):
+    """
+    音声エネルギーの事前解析で、入退場が起こりうる時間帯 (開始秒, 終了秒) のリストを返す。
+    十分に長く続く演奏 (音量があり、平坦度の低い音) の内部では舞台の状態が変わらないとみなし、
+    その両端から audio_prepass_padding_seconds だけ内側の区間を解析対象から外す。
+    演奏らしい区間が見つからない場合は None を返し、呼び出し側は動画全体を解析する。
+    """
+    print("音声エネルギーの事前解析で、動きを解析する時間帯を絞り込みます...")
+    levels, flatness = compute_audio_envelope(video_path)
+    if len(levels) == 0:
+        print("  音声トラックを読み込めなかったため、動画全体を解析します。")
+        return None
+
+    # 無音時の音量を基準に、十分大きく音程感のある音を「演奏」とみなす
+    noise_floor = np.percentile(levels, 10)
+    music = (levels > noise_floor + config.get('audio_prepass_level_db', 12)) & \
+            (flatness < config.get('audio_prepass_flatness', 0.25))
+
+    # 曲中の短い休符や拍手の切れ目で区間が分断されないよう平滑化する
+    smoothing = max(1, int(config.get('audio_prepass_smoothing_seconds', 5) / FRAME_SECONDS))
+    music = np.convolve(music.astype(np.float32), np.ones(smoothing) / smoothing, mode='same') > 0.5
+
+    padding = config.get('audio_prepass_padding_seconds', 45)
+    skipped = []
+    for start, end in _runs(music):
+        start_s, end_s = start * FRAME_SECONDS, end * FRAME_SECONDS
+        if end_s - start_s >= config['min_duration_seconds'] and end_s - start_s > 2 * padding:
+            skipped.append((start_s + padding, end_s - padding))
+
+    if not skipped:
+        print("  演奏らしい区間が見つからなかったため、動画全体を解析します。")
+        return None
+
+    windows = []
+    cursor = 0.0
+    for start_s, end_s in skipped:
+        windows.append((cursor, start_s))
+        cursor = end_s
+    if cursor < duration_seconds:
+        windows.append((cursor, duration_seconds))
+
+    covered = sum(end - start for start, end in windows)
+    print(f"  {len(skipped)}件の演奏区間の内部をスキップし、{len(windows)}個の時間帯 "
+          f"(合計 {covered:.0f}秒 / {duration_seconds:.0f}秒) のみ解析します。")
+    return windows
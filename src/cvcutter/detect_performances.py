@@ -1,195 +1,467 @@
+import os
+import sys
+import multiprocessing
 import cv2
 import numpy as np
 from collections import defaultdict, OrderedDict
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from .audio_prepass import find_candidate_windows, prepass_parameters
+from .frame_source import open_frame_source
+from .motion_timeline import MotionTimeline, MotionTimelineRecorder, column_occupancy, load_motion_timeline, timeline_path
+from scipy.optimize import linear_sum_assignment
 from scipy.spatial import distance as dist
 
 class CentroidTracker:
-    def __init__(self, max_disappeared=50):
+    """
+    重心ベースの物体追跡。状態は事前確保したNumPy配列 (ID・重心・消失フレーム数) で持ち、
+    フレーム間の対応付けは距離行列に対する最適割り当て (linear_sum_assignment) で行う。
+    """
+    def __init__(self, max_disappeared=50, max_distance_ratio=0.3, capacity=16):
         self.next_object_id = 0
-        self.objects = OrderedDict()
-        self.disappeared = OrderedDict()
         self.max_disappeared = max_disappeared
+        self.max_distance_ratio = max_distance_ratio # 距離のしきい値 (フレーム幅に対する割合)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.centroids = np.empty((capacity, 2), dtype=np.int64)
+        self.disappeared = np.empty(capacity, dtype=np.int64)
+        self.count = 0
 
-    def register(self, centroid):
-        self.objects[self.next_object_id] = centroid
-        self.disappeared[self.next_object_id] = 0
-        self.next_object_id += 1
+    @property
+    def objects(self):
+        """追跡中のオブジェクトを {ID: 重心} の辞書 (登録順) で返す"""
+        return OrderedDict(zip(self.ids[:self.count].tolist(), self.centroids[:self.count]))
 
-    def deregister(self, object_id):
-        del self.objects[object_id]
-        del self.disappeared[object_id]
+    def register(self, centroids):
+        centroids = np.asarray(centroids, dtype=np.int64).reshape(-1, 2)
+        new_count = self.count + len(centroids)
+        if new_count > len(self.ids):
+            capacity = max(new_count, 2 * len(self.ids))
+            self.ids = np.resize(self.ids, capacity)
+            self.centroids = np.resize(self.centroids, (capacity, 2))
+            self.disappeared = np.resize(self.disappeared, capacity)
+        self.ids[self.count:new_count] = np.arange(self.next_object_id, self.next_object_id + len(centroids))
+        self.centroids[self.count:new_count] = centroids
+        self.disappeared[self.count:new_count] = 0
+        self.next_object_id += len(centroids)
+        self.count = new_count
+
+    def _deregister_expired(self):
+        n = self.count
+        if n == 0 or self.disappeared[:n].max() <= self.max_disappeared:
+            return
+        alive = self.disappeared[:n] <= self.max_disappeared
+        # 登録順を保ったまま詰める
+        kept = np.flatnonzero(alive)
+        self.ids[:len(kept)] = self.ids[kept]
+        self.centroids[:len(kept)] = self.centroids[kept]
+        self.disappeared[:len(kept)] = self.disappeared[kept]
+        self.count = len(kept)
 
     def update(self, rects, frame_width):
+        """
+        検出矩形 (x, y, w, h) のリストで追跡状態を更新し、
+        追跡中の (ID, [x, y]) のリストを登録順で返す。
+        """
+        n = self.count
         if len(rects) == 0:
-            for object_id in list(self.disappeared.keys()):
-                self.disappeared[object_id] += 1
-                if self.disappeared[object_id] > self.max_disappeared:
-                    self.deregister(object_id)
-            return self.objects
-
-        input_centroids = np.zeros((len(rects), 2), dtype="int")
-        for (i, (x, y, w, h)) in enumerate(rects):
-            c_x = int(x + w / 2.0)
-            c_y = int(y + h / 2.0)
-            input_centroids[i] = (c_x, c_y)
-
-        if len(self.objects) == 0:
-            for i in range(len(input_centroids)):
-                self.register(input_centroids[i])
-        else:
-            object_ids = list(self.objects.keys())
-            object_centroids = list(self.objects.values())
-
-            D = dist.cdist(np.array(object_centroids), input_centroids)
-            rows = D.min(axis=1).argsort()
-            cols = D.argmin(axis=1)[rows]
-
-            used_rows = set()
-            used_cols = set()
-
-            for (row, col) in zip(rows, cols):
-                if row in used_rows or col in used_cols:
-                    continue
-                
-                if D[row, col] > frame_width * 0.3: # 距離のしきい値を少し緩和
-                    continue
-
-                object_id = object_ids[row]
-                self.objects[object_id] = input_centroids[col]
-                self.disappeared[object_id] = 0
-                used_rows.add(row)
-                used_cols.add(col)
-
-            unused_rows = set(range(D.shape[0])).difference(used_rows)
-            unused_cols = set(range(D.shape[1])).difference(used_cols)
-
-            if D.shape[0] >= D.shape[1]:
-                for row in unused_rows:
-                    object_id = object_ids[row]
-                    self.disappeared[object_id] += 1
-                    if self.disappeared[object_id] > self.max_disappeared:
-                        self.deregister(object_id)
-            else:
-                for col in unused_cols:
-                    self.register(input_centroids[col])
-        return self.objects
+            self.disappeared[:n] += 1
+            self._deregister_expired()
+            return self._tracked()
 
-def detect_performances_by_motion(video_path, config):
-    print("動きの検出による演奏区間の検出を開始します...")
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"エラー: 動画ファイル '{video_path}' を開けませんでした。")
-        return []
-
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    
-    max_frames = int(config['max_seconds_to_process'] * fps) if config['max_seconds_to_process'] is not None else float('inf')
+        rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        input_centroids = rects[:, :2] + rects[:, 2:] // 2
 
-    # --- ゾーンと状態の管理 ---
-    LEFT_ZONE_END = width * config['left_zone_end_percent']
-    CENTER_ZONE_END = width * config['center_zone_end_percent']
-    stage_status = 'empty' # 'empty' または 'occupied'
-    performance_start_time = 0
-    performance_segments = []
+        if n == 0:
+            self.register(input_centroids)
+            return self._tracked()
 
-    # --- CVオブジェクト ---
-    back_sub = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=config['mog2_threshold'], detectShadows=False)
-    ct = CentroidTracker(max_disappeared=int(fps * 3)) # 静止時間を考慮し、少し長めに設定
+        D = dist.cdist(self.centroids[:n], input_centroids)
+        rows, cols = linear_sum_assignment(D)
+        within_gate = D[rows, cols] <= frame_width * self.max_distance_ratio
+        rows, cols = rows[within_gate], cols[within_gate]
 
-    # --- 以前のフレームのオブジェクト位置を追跡 ---
-    # IDごとのゾーン履歴を保持
-    last_known_zones = defaultdict(lambda: 'unknown')
-    
-    frame_number = 0
-    while cap.isOpened() and frame_number < max_frames:
-        ret, frame = cap.read()
-        if not ret:
-            break
+        self.centroids[rows] = input_centroids[cols]
+        self.disappeared[:n] += 1
+        self.disappeared[rows] = 0
+
+        unmatched_cols = np.ones(len(input_centroids), dtype=bool)
+        unmatched_cols[cols] = False
+
+        self._deregister_expired()
+        if len(cols) < len(input_centroids):
+            self.register(input_centroids[unmatched_cols])
+        return self._tracked()
+
+    def _tracked(self):
+        n = self.count
+        return list(zip(self.ids[:n].tolist(), self.centroids[:n].tolist()))
+
+def _analysis_geometry(width, height, config):
+    """解析解像度と、それに合わせてスケーリングした各しきい値を求める"""
+    analysis_width = config.get('analysis_width')
+    scale = analysis_width / width if analysis_width and analysis_width < width else 1.0
+    analysis_w = int(round(width * scale))
+    analysis_h = int(round(height * scale))
+    return {
+        'scale': scale,
+        'width': analysis_w,
+        'height': analysis_h,
+        # 縮小・グレースケール化するのは analysis_width が指定された場合のみ
+        'grayscale': bool(analysis_width),
+        'left_zone_end': analysis_w * config['left_zone_end_percent'],
+        'center_zone_end': analysis_w * config['center_zone_end_percent'],
+        # 面積は長さの2乗でスケールする
+        'min_contour_area': config['min_contour_area'] * scale * scale,
+        'erode_iterations': max(1, int(round(2 * scale))),
+        'dilate_iterations': max(1, int(round(4 * scale))),
+    }
 
+def _frame_stride(fps, config):
+    """config の frame_stride または analysis_fps から、何フレームおきに解析するかを決める"""
+    if config.get('analysis_fps'):
+        return max(1, int(round(fps / config['analysis_fps'])))
+    return max(1, int(config.get('frame_stride') or 1))
+
+def _iter_blobs(source, geometry, config, fps, start_frame=0, end_frame=float('inf'),
+                stride=1, show_video=False, recorder=None, record_from=0):
+    """
+    フレームソースを stride フレームおきに背景差分し、(フレーム番号, フレーム, 動体リスト) を返す。
+    動体は (x, y, w, h, 面積) で、面積が min_contour_area (recorder 指定時はその下限) を超えるもの。
+    recorder を渡すと record_from 以降のフレームの特徴量をタイムラインとして記録する。
+    """
+    min_blob_area = recorder.min_blob_area if recorder is not None else geometry['min_contour_area']
+
+    # 間引き解析時も実時間で同じ長さの履歴になるようにスケールする
+    back_sub = cv2.createBackgroundSubtractorMOG2(history=max(50, 500 // stride), varThreshold=config['mog2_threshold'], detectShadows=False)
+
+    analysed_frames = 0
+    for frame_number, frame in source.frames(geometry, start_frame, end_frame, stride):
         fg_mask = back_sub.apply(frame)
         thresh = cv2.threshold(fg_mask, 128, 255, cv2.THRESH_BINARY)[1]
-        thresh = cv2.erode(thresh, None, iterations=2)
-        thresh = cv2.dilate(thresh, None, iterations=4)
+        thresh = cv2.erode(thresh, None, iterations=geometry['erode_iterations'])
+        thresh = cv2.dilate(thresh, None, iterations=geometry['dilate_iterations'])
         
-        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        rects = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > config['min_contour_area']]
-        tracked_centroids = ct.update(rects, width)
-
-        current_zones = {}
-        for (object_id, centroid) in tracked_centroids.items():
-            if centroid[0] < LEFT_ZONE_END: zone = 'left'
-            elif centroid[0] < CENTER_ZONE_END: zone = 'center'
-            else: zone = 'right'
-            current_zones[object_id] = zone
-            
-            # --- 新しい状態管理ロジック ---
+        blobs = []
+        for c in contours:
+            area = cv2.contourArea(c)
+            if area > min_blob_area:
+                blobs.append((*cv2.boundingRect(c), area))
+        if recorder is not None and frame_number >= record_from:
+            recorder.append(frame_number, blobs, column_occupancy(thresh))
+
+        yield frame_number, frame, blobs
+
+        analysed_frames += 1
+        if not show_video and analysed_frames % 100 == 0:
+            print(f"  ... フレーム {frame_number} を処理中 ({frame_number / fps:.2f}秒地点)")
+
+def _track_zone_events(blob_frames, geometry, fps, stride=1, emit_from=0, show_video=False):
+    """
+    (フレーム番号, フレーム, 動体リスト) の列から動体を追跡し、ゾーン遷移イベント
+    (フレーム番号, オブジェクトID, 'enter' または 'exit') を順に返す。
+    emit_from より前のフレームは追跡のウォームアップにのみ使い、イベントは返さない。
+    """
+    LEFT_ZONE_END = geometry['left_zone_end']
+    CENTER_ZONE_END = geometry['center_zone_end']
+
+    # 間引き解析時も実時間で同じ長さの消失猶予になるようにスケールする
+    ct = CentroidTracker(max_disappeared=max(1, int(fps * 3 / stride))) # 静止時間を考慮し、少し長めに設定
+
+    # --- 以前のフレームのオブジェクト位置を追跡 ---
+    # IDごとのゾーン履歴を保持
+    last_known_zones = defaultdict(lambda: 'unknown')
+
+    for frame_number, frame, blobs in blob_frames:
+        rects = [b[:4] for b in blobs if b[4] > geometry['min_contour_area']]
+        tracked_centroids = ct.update(rects, geometry['width'])
+
+        for (object_id, centroid) in tracked_centroids:
+            if centroid[0] < LEFT_ZONE_END: current_zone = 'left'
+            elif centroid[0] < CENTER_ZONE_END: current_zone = 'center'
+            else: current_zone = 'right'
+
             last_zone = last_known_zones[object_id]
-            current_zone = current_zones[object_id]
-            
-            # 舞台が「空」の場合：入場を検出
-            if stage_status == 'empty':
+            if frame_number >= emit_from:
                 if last_zone == 'left' and current_zone == 'center':
-                    stage_status = 'occupied'
-                    performance_start_time = frame_number / fps
-                    print(f"ID {object_id} の入場を検出。演奏開始とみなします: {performance_start_time:.2f}秒")
-            
-            # 舞台が「演奏中」の場合：退場を検出
-            elif stage_status == 'occupied':
-                if last_zone == 'center' and current_zone == 'left':
-                    end_time = frame_number / fps
-                    print(f"ID {object_id} の退場を検出。演奏終了とみなします: {end_time:.2f}秒")
-                    performance_segments.append((performance_start_time, end_time))
-                    stage_status = 'empty' # 舞台をリセット
+                    yield (frame_number, object_id, 'enter')
+                elif last_zone == 'center' and current_zone == 'left':
+                    yield (frame_number, object_id, 'exit')
 
             # ゾーン履歴を更新
             last_known_zones[object_id] = current_zone
 
-        # --- 描画処理 (変更なし) ---
-        if config['show_video']:
-            cv2.line(frame, (int(LEFT_ZONE_END), 0), (int(LEFT_ZONE_END), height), (255, 0, 0), 2)
-            cv2.line(frame, (int(CENTER_ZONE_END), 0), (int(CENTER_ZONE_END), height), (255, 0, 0), 2)
+        # --- 描画処理 (タイムライン再生時はフレームが無いので描画しない) ---
+        if show_video and frame is not None:
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            cv2.line(frame, (int(LEFT_ZONE_END), 0), (int(LEFT_ZONE_END), geometry['height']), (255, 0, 0), 2)
+            cv2.line(frame, (int(CENTER_ZONE_END), 0), (int(CENTER_ZONE_END), geometry['height']), (255, 0, 0), 2)
             for x, y, w, h in rects:
                 cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            for (object_id, centroid) in tracked_centroids.items():
+            for (object_id, centroid) in tracked_centroids:
                  cv2.putText(frame, f"ID {object_id}", (centroid[0] - 10, centroid[1] - 10),
                             cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
                  cv2.circle(frame, (centroid[0], centroid[1]), 4, (0, 0, 255), -1)
             
             new_width = 960
-            ratio = new_width / width
-            resized_frame = cv2.resize(frame, (new_width, int(height * ratio)))
+            ratio = new_width / geometry['width']
+            resized_frame = cv2.resize(frame, (new_width, int(geometry['height'] * ratio)))
             cv2.imshow("Motion Detection", resized_frame)
 
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 break
 
-        frame_number += 1
-        if not config['show_video'] and frame_number > 0 and frame_number % 100 == 0:
-            print(f"  ... フレーム {frame_number} を処理中 ({frame_number / fps:.2f}秒地点)")
-    
-    cap.release()
-    if config['show_video']:
-        cv2.destroyAllWindows()
+def _scan_zone_events(source, geometry, config, fps, start_frame=0, end_frame=float('inf'),
+                      stride=1, emit_from=None, show_video=False, recorder=None):
+    """
+    start_frame から end_frame までを stride フレームおきに解析し、
+    ゾーン遷移イベント (フレーム番号, オブジェクトID, 'enter' または 'exit') を順に返す。
+    emit_from より前のフレームは背景モデルと追跡のウォームアップにのみ使い、イベントは返さない。
+    """
+    emit_from = start_frame if emit_from is None else emit_from
+    blob_frames = _iter_blobs(source, geometry, config, fps, start_frame, end_frame, stride,
+                              show_video=show_video, recorder=recorder, record_from=emit_from)
+    return _track_zone_events(blob_frames, geometry, fps, stride, emit_from, show_video)
+
+def _iter_segments_from_events(events, fps):
+    """
+    ゾーン遷移イベントから舞台の状態 ('empty' / 'occupied') を追跡し、
+    演奏区間 (開始フレーム, 終了フレーム) を退場検出のたびに返す。
+    """
+    stage_status = 'empty' # 'empty' または 'occupied'
+    performance_start_frame = 0
+    for frame_number, object_id, kind in events:
+        # 舞台が「空」の場合：入場を検出
+        if stage_status == 'empty' and kind == 'enter':
+            stage_status = 'occupied'
+            performance_start_frame = frame_number
+            print(f"ID {object_id} の入場を検出。演奏開始とみなします: {frame_number / fps:.2f}秒")
+
+        # 舞台が「演奏中」の場合：退場を検出
+        elif stage_status == 'occupied' and kind == 'exit':
+            print(f"ID {object_id} の退場を検出。演奏終了とみなします: {frame_number / fps:.2f}秒")
+            yield (performance_start_frame, frame_number)
+            stage_status = 'empty' # 舞台をリセット
+
+def _refine_boundary(source, geometry, config, fps, frame_number, kind, stride):
+    """
+    間引き解析で見つけた候補フレームの前後だけを全フレームで再解析し、
+    同じ種類の遷移が起きた正確なフレームを返す。見つからなければ候補をそのまま返す。
+    """
+    window = int(config.get('refine_window_seconds', 3) * fps)
+    warmup = int(config.get('refine_warmup_seconds', 10) * fps)
+    window_start = max(0, frame_number - stride - window)
+    events = [
+        e for e in _scan_zone_events(source, geometry, config, fps, start_frame=max(0, window_start - warmup),
+                                     end_frame=frame_number + window + 1, emit_from=window_start)
+        if e[2] == kind
+    ]
+    if not events:
+        return frame_number
+    return min(events, key=lambda e: abs(e[0] - frame_number))[0]
+
+def _num_workers(config):
+    """config の num_workers から並列プロセス数を決める ('auto' または 0 で全コア)"""
+    num_workers = config.get('num_workers') or 1
+    if num_workers == 'auto' or num_workers == 0:
+        num_workers = os.cpu_count() or 1
+    return max(1, int(num_workers))
+
+def _scan_chunk(video_path, config, start_frame, end_frame, warmup_frames, stride, min_blob_area=None):
+    """
+    別プロセスで動画の一区間を解析する。区間の手前 warmup_frames 分で背景モデルと
+    追跡を安定させてから、区間内のゾーン遷移イベントだけをリストで返す。
+    min_blob_area を指定すると、区間内の特徴量タイムラインも合わせて返す。
+    """
+    source = open_frame_source(video_path, config)
+    recorder = MotionTimelineRecorder(min_blob_area) if min_blob_area is not None else None
+    try:
+        geometry = _analysis_geometry(source.width, source.height, config)
+        events = list(_scan_zone_events(source, geometry, config, source.fps, start_frame=max(0, start_frame - warmup_frames),
+                                        end_frame=end_frame, stride=stride, emit_from=start_frame, recorder=recorder))
+        return events, recorder.to_timeline({}) if recorder is not None else None
+    finally:
+        source.release()
+
+def _split_ranges(ranges, num_parts):
+    """フレーム範囲のリストを、合計がおおよそ num_parts 等分になるよう分割する"""
+    total = sum(end - start for start, end in ranges)
+    max_length = max(1, -(-total // num_parts))
+    chunks = []
+    for start, end in ranges:
+        n = max(1, -(-(end - start) // max_length))
+        bounds = np.linspace(start, end, n + 1).astype(int)
+        chunks.extend((int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a)
+    return chunks
+
+def _scan_chunks_in_parallel(video_path, config, fps, ranges, stride, num_workers, min_blob_area=None, timeline_parts=None,
+                             last_end=None):
+    """
+    解析対象のフレーム範囲を num_workers 個程度の区間に分割し、各区間を別プロセスで解析する。
+    イベントは区間の時間順に、その区間の解析が終わりしだい返す。
+    min_blob_area を指定した場合は、区間ごとの特徴量タイムラインを timeline_parts に追加する。
+    last_end を指定した場合は、最後の区間の終端をそれに置き換える (float('inf') ならデコーダが止まるまで読む)。
+    """
+    warmup_frames = int(config.get('chunk_warmup_seconds', 30) * fps)
+    chunks = _split_ranges(ranges, num_workers)
+    if last_end is not None:
+        chunks[-1] = (chunks[-1][0], last_end)
+    print(f"{len(chunks)}個の区間に分割し、{num_workers}プロセスで並列に解析します。")
+
+    # fork だと、他スレッドが出力中に保持していた stdout のロックを子プロセスが引き継いでデッドロックしうるため spawn を使う
+    executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = [
+            executor.submit(_scan_chunk, video_path, config, start, end, warmup_frames, stride, min_blob_area)
+            for start, end in chunks
+        ]
+        # 区間は時間順に並んでいるので、結果を順に連結すれば全体のイベント列になる
+        for future in futures:
+            chunk_events, timeline_part = future.result()
+            if timeline_parts is not None:
+                timeline_parts.append(timeline_part)
+            yield from chunk_events
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def iter_performances_by_motion(video_path, config):
+    """
+    動きの検出で演奏区間 (開始秒, 終了秒) を求め、退場を検出して区間が確定するたびに時間順で返す。
+    動画全体の解析を待たずに、後段の同期やエンコードを始められる。
+    """
+    print("動きの検出による演奏区間の検出を開始します...")
+    # 開けない動画は空の検出結果と区別がつかず、そのままキャッシュされてしまうため例外のまま呼び出し元へ伝える
+    source = open_frame_source(video_path, config)
+
+    fps = source.fps
     
-    final_segments = [seg for seg in performance_segments if (seg[1] - seg[0]) >= config['min_duration_seconds']]
-    print(f"動きの区間を {len(performance_segments)}件検出、うち{len(final_segments)}件が指定長を満たしています。")
-    return sorted(final_segments, key=lambda x: x[0])
+    max_frames = int(config['max_seconds_to_process'] * fps) if config['max_seconds_to_process'] is not None else float('inf')
+
+    # --- 解析解像度 (analysis_width 指定時は縮小グレースケールで解析) ---
+    geometry = _analysis_geometry(source.width, source.height, config)
+    if geometry['grayscale']:
+        print(f"解析解像度: {geometry['width']}x{geometry['height']} (グレースケール)")
+
+    # --- 間引き解析 (frame_stride / analysis_fps 指定時) ---
+    stride = _frame_stride(fps, config)
+    if stride > 1:
+        print(f"{stride}フレームおきに解析し、候補の前後のみ全フレームで再解析します。")
+
+    # --- 特徴量タイムライン (feature_cache 指定時) ---
+    # 背景差分の結果を左右するパラメータが同じなら、保存済みのタイムラインから再検出する
+    timeline_file = None
+    timeline = None
+    min_blob_area = None
+    if config.get('feature_cache'):
+        timeline_file = timeline_path(video_path, {
+            'mog2_threshold': config['mog2_threshold'],
+            'analysis_width': config.get('analysis_width'),
+            'frame_source': config.get('frame_source', 'opencv'),
+            'deinterlace': config.get('deinterlace', True),
+            'stride': stride,
+            'max_seconds_to_process': config['max_seconds_to_process'],
+            # 事前解析を使うと記録されるフレームの範囲が変わるため、そのパラメータもキーに含める
+            'audio_prepass': prepass_parameters(config) if config.get('audio_prepass') else None,
+        }, config.get('feature_cache_dir'))
+        timeline = load_motion_timeline(timeline_file, geometry['min_contour_area'])
+        if timeline is None and not config['show_video']:
+            # 後から min_contour_area を小さくしても再生できるよう、小さめの動体まで記録しておく
+            min_blob_area = min(geometry['min_contour_area'],
+                                config.get('timeline_min_contour_area', 500) * geometry['scale'] ** 2)
+
+    # --- 解析するフレーム範囲 (audio_prepass 指定時は音声から候補の時間帯に絞る) ---
+    total_frames = min(source.frame_count, max_frames)
+    ranges = [(0, max_frames)]
+    if config.get('audio_prepass') and timeline is None and total_frames > 0:
+        windows = find_candidate_windows(video_path, config, total_frames / fps)
+        if windows is not None:
+            ranges = [(int(start * fps), min(int(np.ceil(end * fps)), total_frames)) for start, end in windows]
+
+    # --- 並列解析 (num_workers 指定時、プレビュー表示中は使わない) ---
+    num_workers = _num_workers(config)
+    recorder = None
+    timeline_parts = []
+    if timeline is not None:
+        print(f"保存済みの特徴量タイムラインから再検出します: {timeline_file}")
+        events = _track_zone_events(timeline.iter_frames(), geometry, fps, stride)
+    elif num_workers > 1 and total_frames > 0 and not config['show_video']:
+        # 分割はフレーム数の推定値で行うが、推定値は VFR の動画などで実際より少ないことがあるため、
+        # 最後の区間は直列の解析と同じく動画の終わりまで読む
+        last_end = None
+        if ranges[-1][1] == float('inf'):
+            ranges[-1] = (ranges[-1][0], total_frames)
+            last_end = max_frames
+        events = _scan_chunks_in_parallel(video_path, config, fps, ranges, stride,
+                                          num_workers, min_blob_area, timeline_parts, last_end)
+    else:
+        # 飛び飛びの範囲は、手前にウォームアップを付けてから順に解析する
+        warmup_frames = int(config.get('chunk_warmup_seconds', 30) * fps)
+        recorder = MotionTimelineRecorder(min_blob_area) if min_blob_area is not None else None
+        events = chain.from_iterable(
+            _scan_zone_events(source, geometry, config, fps, start_frame=max(0, start - warmup_frames),
+                              end_frame=end, stride=stride, emit_from=start,
+                              show_video=config['show_video'], recorder=recorder)
+            for start, end in ranges
+        )
+
+    # 境界の補正は本解析と並行して行うため、別のフレームソースを開いて使う
+    refine_source = None
+    # 補正しても指定長に届かない区間は再解析しない
+    refine_margin = 2 * (config.get('refine_window_seconds', 3) + stride / fps)
+    detected = 0
+    accepted = 0
+    try:
+        for start_frame, end_frame in _iter_segments_from_events(events, fps):
+            detected += 1
+            if stride > 1 and (end_frame - start_frame) / fps + refine_margin >= config['min_duration_seconds']:
+                if refine_source is None:
+                    refine_source = open_frame_source(video_path, config)
+                start_frame = _refine_boundary(refine_source, geometry, config, fps, start_frame, 'enter', stride)
+                end_frame = _refine_boundary(refine_source, geometry, config, fps, end_frame, 'exit', stride)
+                print(f"  境界を補正しました: {start_frame / fps:.2f}秒 - {end_frame / fps:.2f}秒")
+            if (end_frame - start_frame) / fps >= config['min_duration_seconds']:
+                accepted += 1
+                yield (start_frame / fps, end_frame / fps)
+    finally:
+        if config['show_video']:
+            cv2.destroyAllWindows()
+        source.release()
+        if refine_source is not None:
+            refine_source.release()
+
+    if min_blob_area is not None:
+        metadata = {'fps': fps, 'stride': stride, 'width': geometry['width'], 'height': geometry['height']}
+        if recorder is not None:
+            new_timeline = recorder.to_timeline(metadata)
+        else:
+            new_timeline = MotionTimeline.concatenate(timeline_parts, metadata)
+        try:
+            new_timeline.save(timeline_file)
+            print(f"特徴量タイムラインを保存しました: {timeline_file}")
+        except OSError as e:
+            print(f"特徴量タイムラインを保存できませんでした: {e}")
+
+    print(f"動きの区間を {detected}件検出、うち{accepted}件が指定長を満たしています。")
+
+def detect_performances_by_motion(video_path, config):
+    return sorted(iter_performances_by_motion(video_path, config), key=lambda x: x[0])
 
 if __name__ == '__main__':
+    # 相対インポートを使うため、python -m cvcutter.detect_performances [動画ファイル] として実行する
     detection_config = {
         'max_seconds_to_process': 480,
         'min_duration_seconds': 30,
         'show_video': True,
+        'analysis_width': 320,
         'mog2_threshold': 40, 
         'min_contour_area': 3000,
         'left_zone_end_percent': 0.25,
         'center_zone_end_percent': 0.55
     }
     
-    video_file = 'input/00002.MTS'
+    video_file = sys.argv[1] if len(sys.argv) > 1 else 'input/00002.MTS'
     segments = detect_performances_by_motion(video_file, detection_config)
     
     if segments:
@@ -0,0 +1,130 @@
+import subprocess
+import tempfile
+import cv2
+import numpy as np
+import imageio_ffmpeg
+from .video_utils import probe_video, hidden_startupinfo, ffmpeg_input_args, is_concat_list, read_stderr_tail
+
+def prepare_frame(frame, geometry):
+    """フレームを解析用の小さなグレースケール画像に変換する"""
+    if not geometry['grayscale']:
+        return frame
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if geometry['scale'] < 1.0:
+        gray = cv2.resize(gray, (geometry['width'], geometry['height']), interpolation=cv2.INTER_AREA)
+    return gray
+
+class OpenCVFrameSource:
+    """cv2.VideoCapture でデコードし、Python側で縮小・グレースケール化するフレームソース"""
+
+    def __init__(self, video_path):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise IOError(f"動画ファイル '{video_path}' を開けませんでした。")
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def frames(self, geometry, start_frame=0, end_frame=float('inf'), stride=1):
+        """(フレーム番号, 解析用フレーム) を stride フレームおきに返す"""
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_number = start_frame
+        while frame_number < end_frame:
+            ret, frame = self.cap.read()
+            if not ret:
+                return
+            yield frame_number, prepare_frame(frame, geometry)
+
+            # 間引き対象のフレームはデコードのみ行い、変換はスキップする
+            frame_number += 1
+            for _ in range(stride - 1):
+                if frame_number >= end_frame or not self.cap.grab():
+                    return
+                frame_number += 1
+
+    def release(self):
+        self.cap.release()
+
+class FFmpegFrameSource:
+    """
+    ffmpeg のサブプロセスから rawvideo (gray、縮小しない場合は bgr24) をパイプで受け取るフレームソース。
+    間引き・インターレース解除・縮小は ffmpeg のマルチスレッドなフィルタグラフ内で行い、
+    受け取ったフレームは使い回しのNumPyバッファに読み込む。分割された録画の連結リスト (.ffconcat) も読める。
+    """
+
+    def __init__(self, video_path, deinterlace=True):
+        self.video_path = video_path
+        self.deinterlace = deinterlace
+        info = probe_video(video_path)
+        if not info['width'] or not info['fps']:
+            raise IOError(f"動画ファイル '{video_path}' を開けませんでした。")
+        self.width = info['width']
+        self.height = info['height']
+        self.fps = info['fps']
+        self.frame_count = int(info['duration'] * self.fps) if info['duration'] else 0
+
+    def _build_command(self, geometry, start_frame, end_frame, stride):
+        filters = []
+        if self.deinterlace:
+            # yadif は前後のフレームから補間するため、間引く前の連続したフレームに対してかける
+            filters.append('yadif')
+        if stride > 1:
+            # 元のフレーム番号と対応が取れるよう、fps フィルタではなく select で間引く
+            filters.append(f"select='not(mod(n\\,{stride}))'")
+        if geometry['grayscale'] and geometry['scale'] < 1.0:
+            filters.append(f"scale={geometry['width']}:{geometry['height']}:flags=area")
+        pix_fmt = 'gray' if geometry['grayscale'] else 'bgr24'
+        filters.append(f"format={pix_fmt}")
+
+        command = [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-nostdin']
+        if start_frame > 0:
+            command += ['-ss', f"{start_frame / self.fps:.6f}"]
+        command += ffmpeg_input_args(self.video_path) + ['-an', '-sn', '-vf', ','.join(filters), '-fps_mode', 'passthrough']
+        if end_frame != float('inf'):
+            command += ['-frames:v', str(max(0, -(-(end_frame - start_frame) // stride)))]
+        command += ['-pix_fmt', pix_fmt, '-f', 'rawvideo', 'pipe:1']
+        return command
+
+    def frames(self, geometry, start_frame=0, end_frame=float('inf'), stride=1):
+        """(フレーム番号, 解析用フレーム) を stride フレームおきに返す。フレームのバッファは使い回される"""
+        if geometry['grayscale']:
+            buffer = np.empty((geometry['height'], geometry['width']), dtype=np.uint8)
+        else:
+            buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        view = memoryview(buffer).cast('B')
+        # エラー出力はパイプを詰まらせないよう一時ファイルに受け、失敗時のメッセージに使う
+        stderr_file = tempfile.TemporaryFile()
+        process = subprocess.Popen(self._build_command(geometry, start_frame, end_frame, stride),
+                                   stdout=subprocess.PIPE, stderr=stderr_file,
+                                   bufsize=buffer.nbytes * 4, startupinfo=hidden_startupinfo())
+        try:
+            frame_number = start_frame
+            while frame_number < end_frame:
+                if process.stdout.readinto(view) != buffer.nbytes:
+                    # 出力が尽きた場合、ffmpeg が異常終了していれば途中までの結果を正常終了と区別する
+                    if process.wait() != 0:
+                        raise IOError(f"ffmpeg による '{self.video_path}' のデコードに失敗しました "
+                                      f"(終了コード {process.returncode}): {read_stderr_tail(stderr_file)}")
+                    return
+                yield frame_number, buffer
+                frame_number += stride
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            stderr_file.close()
+
+    def release(self):
+        pass
+
+def open_frame_source(video_path, config):
+    """
+    config の frame_source ('opencv' または 'ffmpeg') に応じたフレームソースを開く。
+    連結リストは OpenCV では開けないため、常に ffmpeg で読む。
+    """
+    if is_concat_list(video_path) or config.get('frame_source', 'opencv') == 'ffmpeg':
+        return FFmpegFrameSource(video_path, deinterlace=config.get('deinterlace', True))
+    return OpenCVFrameSource(video_path)
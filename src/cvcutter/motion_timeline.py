@@ -0,0 +1,127 @@
+import os
+import json
+import hashlib
+import numpy as np
+from .video_utils import file_fingerprint
+
+COLUMN_BINS = 32
+
+def column_occupancy(mask, bins=COLUMN_BINS):
+    """前景マスクを横方向に bins 個の列に分け、各列の前景画素の割合を 0-255 で返す"""
+    height, width = mask.shape[:2]
+    edges = np.linspace(0, width, bins + 1).astype(int)
+    column_counts = np.count_nonzero(mask, axis=0)
+    counts = np.add.reduceat(column_counts, edges[:-1])
+    return (counts * 255 // (np.diff(edges) * height)).astype(np.uint8)
+
+class MotionTimelineRecorder:
+    """解析したフレームごとの動体 (x, y, w, h, 面積) と列占有率ヒストグラムを記録する"""
+
+    def __init__(self, min_blob_area):
+        self.min_blob_area = min_blob_area
+        self.frame_numbers = []
+        self.blob_counts = []
+        self.blobs = []
+        self.histograms = []
+
+    def append(self, frame_number, blobs, histogram):
+        self.frame_numbers.append(frame_number)
+        self.blob_counts.append(len(blobs))
+        self.blobs.extend(blobs)
+        self.histograms.append(histogram)
+
+    def to_timeline(self, metadata):
+        blob_offsets = np.zeros(len(self.blob_counts) + 1, dtype=np.int64)
+        np.cumsum(self.blob_counts, out=blob_offsets[1:])
+        return MotionTimeline(
+            frame_numbers=np.asarray(self.frame_numbers, dtype=np.int64),
+            blob_offsets=blob_offsets,
+            blobs=np.asarray(self.blobs, dtype=np.float32).reshape(-1, 5),
+            histograms=np.asarray(self.histograms, dtype=np.uint8).reshape(-1, COLUMN_BINS),
+            metadata=dict(metadata, min_blob_area=self.min_blob_area),
+        )
+
+class MotionTimeline:
+    """
+    背景差分後の特徴量タイムライン。ゾーンや最小面積・最小演奏時間を変えた再検出は、
+    動画を再デコードせずにこのタイムラインを再生するだけで行える。
+    """
+
+    def __init__(self, frame_numbers, blob_offsets, blobs, histograms, metadata):
+        self.frame_numbers = frame_numbers
+        self.blob_offsets = blob_offsets
+        self.blobs = blobs
+        self.histograms = histograms
+        self.metadata = metadata
+
+    @classmethod
+    def concatenate(cls, parts, metadata):
+        """時間順に並んだ区間ごとのタイムラインを1本にまとめる"""
+        offsets = [np.zeros(1, dtype=np.int64)]
+        base = 0
+        for part in parts:
+            offsets.append(part.blob_offsets[1:] + base)
+            base += part.blob_offsets[-1]
+        return cls(
+            frame_numbers=np.concatenate([p.frame_numbers for p in parts]),
+            blob_offsets=np.concatenate(offsets),
+            blobs=np.concatenate([p.blobs for p in parts]),
+            histograms=np.concatenate([p.histograms for p in parts]),
+            metadata=dict(metadata, min_blob_area=max(p.metadata['min_blob_area'] for p in parts)),
+        )
+
+    def iter_frames(self):
+        """(フレーム番号, None, 動体リスト) を記録順に返す。フレーム画像は保持していないので None"""
+        for i, frame_number in enumerate(self.frame_numbers.tolist()):
+            start, end = self.blob_offsets[i], self.blob_offsets[i + 1]
+            yield frame_number, None, self.blobs[start:end].tolist()
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            frame_numbers=self.frame_numbers,
+            blob_offsets=self.blob_offsets,
+            blobs=self.blobs,
+            histograms=self.histograms,
+            metadata=np.array(json.dumps(self.metadata)),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                frame_numbers=data['frame_numbers'],
+                blob_offsets=data['blob_offsets'],
+                blobs=data['blobs'],
+                histograms=data['histograms'],
+                metadata=json.loads(str(data['metadata'])),
+            )
+
+def timeline_path(video_path, key_params, cache_dir=None):
+    """
+    動画ファイルの同一性 (サイズ・更新時刻・先頭/末尾のハッシュ) と、
+    背景差分の結果を左右するパラメータから、タイムラインの保存先を決める。
+    cache_dir を省略した場合は動画ファイルの隣に保存する。
+    """
+    key = hashlib.sha1(json.dumps({
+        'fingerprint': file_fingerprint(video_path),
+        'params': key_params,
+    }, sort_keys=True).encode()).hexdigest()[:16]
+    directory = cache_dir or os.path.dirname(os.path.abspath(video_path))
+    return os.path.join(directory, f"{os.path.basename(video_path)}.motion-{key}.npz")
+
+def load_motion_timeline(path, min_contour_area):
+    """保存済みのタイムラインを読み込む。存在しない、または min_contour_area が記録時の下限より小さい場合は None"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        timeline = MotionTimeline.load(path)
+    except Exception as e:
+        print(f"特徴量タイムラインの読み込みに失敗しました: {e}")
+        return None
+    if min_contour_area < timeline.metadata['min_blob_area']:
+        return None
+    return timeline
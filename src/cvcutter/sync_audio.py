@@ -2,104 +2,484 @@ import librosa
 import numpy as np
 import os
 import argparse
+import hashlib
+import json
+import tempfile
+from scipy import fft as sp_fft
 from scipy.signal import correlate
+from .video_utils import iter_audio_blocks, file_fingerprint
 
-def find_anchor(audio, sr, duration_s=15):
-    """音声内で最も音量が大きい部分をアンカーとして切り出す"""
+def _frame_energies(audio, frame_size, hop_size):
+    """
+    hop_size ごとの frame_size サンプルのエネルギーを一度に計算する。
+    音声を hop_size サンプルのブロックに分けて二乗和を求め、その累積和の差分と端数ブロックの和を足し合わせる。
+    """
+    n_frames = len(range(0, len(audio) - frame_size, hop_size))
+    if n_frames == 0:
+        return np.zeros(0)
+    full_blocks, remainder = divmod(frame_size, hop_size)
+    n_blocks = n_frames + full_blocks + (1 if remainder else 0)
+    if len(audio) >= n_blocks * hop_size:
+        blocks = np.asarray(audio[:n_blocks * hop_size], dtype=np.float32).reshape(n_blocks, hop_size)
+    else:
+        padded = np.zeros(n_blocks * hop_size, dtype=np.float32)
+        padded[:len(audio)] = audio
+        blocks = padded.reshape(n_blocks, hop_size)
+
+    block_energy = np.einsum('ij,ij->i', blocks, blocks).astype(np.float64)
+    cumulative = np.concatenate([[0.0], np.cumsum(block_energy)])
+    energy = cumulative[full_blocks:full_blocks + n_frames] - cumulative[:n_frames]
+    if remainder:
+        tail = blocks[full_blocks:full_blocks + n_frames, :remainder]
+        energy += np.einsum('ij,ij->i', tail, tail)
+    return energy
+
+def find_anchors(audio, sr, duration_s=15, count=1):
+    """
+    音声内で音量が大きい部分を、互いに重ならない最大 count 個のアンカーとして切り出す。
+    (アンカーの波形, 開始サンプル) のリストをエネルギーの大きい順に返す。
+    """
     frame_size = int(sr * 0.1) # 0.1秒ごとのエネルギーを計算
     hop_size = int(sr * 0.05)
-    
-    # 音声エネルギーの移動平均を計算
-    energy = np.array([
-        np.sum(np.abs(audio[i:i+frame_size])**2)
-        for i in range(0, len(audio) - frame_size, hop_size)
-    ])
-    
-    # 最もエネルギーが高いフレームの中心を見つける
-    energetic_frame_index = np.argmax(energy)
-    center_sample = energetic_frame_index * hop_size + frame_size // 2
-    
-    # アンカーの開始・終了サンプルを決定
     anchor_duration_samples = int(duration_s * sr)
-    start_sample = max(0, center_sample - anchor_duration_samples // 2)
-    end_sample = min(len(audio), start_sample + anchor_duration_samples)
-    
-    anchor_audio = audio[start_sample:end_sample]
-    
-    print(f"最も特徴的な部分（アンカー）を {start_sample/sr:.2f}秒地点から {duration_s}秒間 切り出しました。")
-    return anchor_audio, start_sample
 
-def find_audio_offset(haystack_path, needle_path, target_sr):
+    # 音声エネルギーの移動平均を計算
+    energy = _frame_energies(audio, frame_size, hop_size)
+    if len(energy) == 0:
+        return [(audio, 0)]
+
+    anchors = []
+    # エネルギーの高いフレームから順に、既に選んだアンカーと重ならないものを採用する
+    for frame_index in np.argsort(energy)[::-1]:
+        center_sample = int(frame_index) * hop_size + frame_size // 2
+
+        # アンカーの開始・終了サンプルを決定
+        start_sample = max(0, center_sample - anchor_duration_samples // 2)
+        end_sample = min(len(audio), start_sample + anchor_duration_samples)
+        if any(start_sample < other_end and other_start < end_sample for _, other_start, other_end in anchors):
+            continue
+        anchors.append((audio[start_sample:end_sample], start_sample, end_sample))
+        if len(anchors) >= count:
+            break
+
+    for _, start_sample, _ in anchors:
+        print(f"最も特徴的な部分（アンカー）を {start_sample/sr:.2f}秒地点から {duration_s}秒間 切り出しました。")
+    return [(anchor_audio, start_sample) for anchor_audio, start_sample, _ in anchors]
+
+def find_anchor(audio, sr, duration_s=15):
+    """音声内で最も音量が大きい部分をアンカーとして切り出す"""
+    return find_anchors(audio, sr, duration_s, count=1)[0]
+
+ENVELOPE_RATE = 200          # 粗い探索に使う包絡線のレート (Hz)
+REFINE_RADIUS_SECONDS = 1.0  # 細かい探索で粗いラグの前後に探す幅 (秒)
+COARSE_CANDIDATES = 3        # 細かい探索に進める粗いラグの候補数
+PEAK_EXCLUSION_SECONDS = 0.05  # 信頼度の計算でピークとみなす前後の幅 (秒)
+MIN_PEAK_CONFIDENCE = 6.0    # 範囲を絞った探索の結果を採用する信頼度の下限
+ANCHOR_COUNT = 3             # 1つの needle から切り出すアンカーの数
+ANCHOR_AGREEMENT_SECONDS = 0.1  # アンカー同士の結果が一致しているとみなす幅 (秒)
+DECODE_BLOCK_SECONDS = 30    # haystack をストリーミングデコードするブロックの長さ (秒)
+OVERLAP_SAVE_FFT_SIZE = 1 << 20  # 全域探索で1回のFFTにかける haystack の最小サンプル数
+NPY_HEADER_SIZE = 128        # 1次元 float32 配列の .npy ヘッダの長さ (バイト)
+
+def rms_envelope(audio, hop):
+    """hop サンプルごとのRMSを正規化した包絡線を返す"""
+    n_frames = len(audio) // hop
+    frames = np.asarray(audio[:n_frames * hop], dtype=np.float32).reshape(n_frames, hop)
+    envelope = np.sqrt(np.mean(frames ** 2, axis=1))
+    return (envelope - np.mean(envelope)) / (np.std(envelope) + 1e-9)
+
+def _write_npy_header(f, length):
+    """1次元 float32 配列の .npy ヘッダを、長さ NPY_HEADER_SIZE に揃えて書き込む"""
+    f.seek(0)
+    np.lib.format.write_array_header_1_0(f, {'descr': '<f4', 'fortran_order': False, 'shape': (length,)})
+    if f.tell() != NPY_HEADER_SIZE:
+        raise ValueError(".npy ヘッダの長さが想定と異なります。")
+
+def decode_audio_to_npy(media_path, sample_rate, npy_path, hop):
     """
-    アンカー検索を用いて、2つの音声ファイルのオフセットを高精度に計算する。
+    音声を ffmpeg で mono float32 にストリーミングデコードしながら .npy に書き出す。
+    メモリ上にはブロック1つ分しか持たず、同じパスで平均・標準偏差と hop サンプルごとのRMS包絡線も求める。
+    (平均, 標準偏差, 包絡線) を返す。包絡線は正規化済み。
+    """
+    block_size = hop * max(1, int(DECODE_BLOCK_SECONDS * sample_rate) // hop)
+    total, total_sq, length = 0.0, 0.0, 0
+    envelopes = []
+    with open(npy_path, 'wb') as f:
+        f.write(b'\0' * NPY_HEADER_SIZE)
+        for block in iter_audio_blocks(media_path, sample_rate, block_size):
+            f.write(block.tobytes())
+            block64 = block.astype(np.float64)
+            total += float(np.sum(block64))
+            total_sq += float(np.dot(block64, block64))
+            length += len(block)
+            n_frames = len(block) // hop
+            if n_frames:
+                frames = block[:n_frames * hop].reshape(n_frames, hop)
+                envelopes.append(np.sqrt(np.einsum('ij,ij->i', frames, frames) / hop))
+        _write_npy_header(f, length)
+    if length == 0:
+        raise ValueError(f"音声を読み込めませんでした: {media_path}")
+
+    mean = total / length
+    std = float(np.sqrt(max(total_sq / length - mean * mean, 0.0))) or 1.0
+    envelope = np.concatenate(envelopes) if envelopes else np.zeros(0, dtype=np.float32)
+    envelope = (envelope - np.mean(envelope)) / (np.std(envelope) + 1e-9)
+    return mean, std, envelope
+
+def _envelope_hop(sample_rate):
+    return max(1, int(round(sample_rate / ENVELOPE_RATE)))
+
+def get_audio_cache_path(media_path, sample_rate, cache_dir):
+    """デコード済み音声キャッシュの保存先。ファイルの同一性 (サイズ・更新時刻・先頭/末尾のハッシュ) とサンプリングレートで決まる"""
+    key = hashlib.sha1(json.dumps({
+        'fingerprint': file_fingerprint(media_path),
+        'sample_rate': int(sample_rate),
+    }, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(media_path)}.{int(sample_rate)}hz-{key}.npy")
+
+def open_decoded_audio(media_path, sample_rate, cache_dir):
     """
-    print(f"\n--- 音声同期を開始します (アンカー検索モード) ---")
-    print(f"基準音声 (haystack): {os.path.basename(haystack_path)}")
-    print(f"対象音声 (needle): {os.path.basename(needle_path)}")
-    print(f"処理レート: {target_sr} Hz")
+    cache_dir にある mono float32 の .npy キャッシュをメモリマップで開く。キャッシュがなければデコードして作る。
+    (波形, 平均, 標準偏差, 正規化済みRMS包絡線) を返す。統計量と包絡線は隣の .stats.npz に保存する。
+    """
+    npy_path = get_audio_cache_path(media_path, sample_rate, cache_dir)
+    stats_path = npy_path[:-len('.npy')] + '.stats.npz'
+    hop = _envelope_hop(sample_rate)
+    if os.path.exists(npy_path) and os.path.exists(stats_path):
+        try:
+            with np.load(stats_path) as stats:
+                if int(stats['hop']) == hop:
+                    print(f"デコード済みの音声キャッシュを使用します: {os.path.basename(npy_path)}")
+                    return (np.load(npy_path, mmap_mode='r'), float(stats['mean']), float(stats['std']),
+                            stats['envelope'])
+        except Exception as e:
+            print(f"音声キャッシュの読み込みに失敗したため、デコードし直します: {e}")
 
+    print(f"{os.path.basename(media_path)} を {sample_rate} Hz でデコードしてキャッシュします...")
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = npy_path + '.tmp'
     try:
-        # 1. 音声ファイルを読み込み
-        print("Haystackファイルを読み込み中...")
-        haystack_audio, _ = librosa.load(haystack_path, sr=target_sr)
-        
-        print("Needleファイルを読み込み中...")
-        needle_audio, _ = librosa.load(needle_path, sr=target_sr)
-        
-        # 2. Needleからアンカー（最も特徴的な部分）を切り出す
-        anchor_audio, anchor_start_in_needle = find_anchor(needle_audio, target_sr)
+        mean, std, envelope = decode_audio_to_npy(media_path, sample_rate, tmp_path, hop)
+    except Exception:
+        # 途中で失敗したデコード結果はキャッシュに残さない
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, npy_path)
+    with open(stats_path + '.tmp', 'wb') as f:
+        np.savez(f, hop=hop, mean=mean, std=std, envelope=envelope)
+    os.replace(stats_path + '.tmp', stats_path)
+    return np.load(npy_path, mmap_mode='r'), mean, std, envelope
+
+def _peak_confidence(correlation, peak, exclusion):
+    """
+    相関のピーク対サイドローブ比 (PSR)。ピークの前後 exclusion サンプルを除いた部分の
+    平均と標準偏差で、ピークがどれだけ突出しているかを測る。
+    """
+    sidelobes = np.concatenate([correlation[:max(0, peak - exclusion)], correlation[peak + exclusion + 1:]])
+    if len(sidelobes) < 2:
+        return 0.0
+    return float((correlation[peak] - np.mean(sidelobes)) / (np.std(sidelobes) + 1e-9))
 
-        # 3. 音量を正規化
-        print("波形を正規化中...")
-        haystack_norm = (haystack_audio - np.mean(haystack_audio)) / np.std(haystack_audio)
-        anchor_norm = (anchor_audio - np.mean(anchor_audio)) / np.std(anchor_audio)
+def _combine_anchor_results(results, sr):
+    """
+    アンカーごとの (オフセット[サンプル], 信頼度) をまとめる。信頼度の合計が最も大きい一致グループを採用し、
+    そのグループで最も信頼度の高いアンカーのオフセットと、全アンカーで平均した信頼度を返す。
+    """
+    valid = [(offset, confidence) for offset, confidence in results if offset is not None]
+    if not valid:
+        return None, 0.0
+    agreement = ANCHOR_AGREEMENT_SECONDS * sr
+    best_group, best_support = [], -np.inf
+    for offset, _ in valid:
+        group = [(o, c) for o, c in valid if abs(o - offset) <= agreement]
+        support = sum(c for _, c in group)
+        if support > best_support:
+            best_group, best_support = group, support
+    best_offset = max(best_group, key=lambda result: result[1])[0]
+    return best_offset, best_support / len(results)
 
-        # 4. クロス相関でアンカーをHaystackから探す
-        print("アンカーをHaystack内で検索中...")
-        correlation = correlate(haystack_norm, anchor_norm, mode='valid')
-        
-        # 5. 最も相関が高かった位置（ラグ）を見つける
-        lag_in_haystack = np.argmax(correlation)
+class AudioSyncSession:
+    """
+    基準音声 (haystack) を一度だけ読み込み・リサンプリング・正規化して保持し、
+    複数の対象音声 (needle) のオフセット計算に使い回す。
+    hierarchical=True の場合は、まず 200Hz のRMS包絡線同士の相関で大まかなラグを求め、
+    その前後 ±1秒だけを target_sr で相関させて精密なラグを求める。
+    needle ごとに anchor_count 個のアンカーを探し、結果をピーク対サイドローブ比 (PSR) で重み付けしてまとめる。
+    """
+
+    def __init__(self, haystack_path, target_sr, hierarchical=True, anchor_count=ANCHOR_COUNT,
+                 streaming=True, cache_dir=None):
+        mode = "粗密探索" if hierarchical else "全域探索"
+        print(f"\n--- 音声同期セッションを開始します (アンカー検索モード / {mode}) ---")
+        print(f"基準音声 (haystack): {os.path.basename(haystack_path)}")
+        print(f"処理レート: {target_sr} Hz")
+        self.haystack_path = haystack_path
+        self.target_sr = target_sr
+        self.hierarchical = hierarchical
+        self.anchor_count = anchor_count
+        self.hop = _envelope_hop(target_sr)
+        self._decoded_path = None
+        self._envelope_spectrum = (0, None)
+
+        if streaming and cache_dir:
+            # 同じ録音を使う再実行や複数の動画ペアでは、デコード済みのキャッシュを使い回す
+            self.haystack, self.haystack_mean, self.haystack_std, self.haystack_envelope = open_decoded_audio(
+                haystack_path, target_sr, cache_dir)
+        elif streaming:
+            # 数時間の録音でもメモリに載せないよう、デコード結果はディスク上の .npy をメモリマップで参照する
+            print("Haystackファイルをストリーミングデコード中...")
+            fd, self._decoded_path = tempfile.mkstemp(suffix='.npy', prefix='haystack_')
+            os.close(fd)
+            self.haystack_mean, self.haystack_std, self.haystack_envelope = decode_audio_to_npy(
+                haystack_path, target_sr, self._decoded_path, self.hop)
+            self.haystack = np.load(self._decoded_path, mmap_mode='r')
+        else:
+            print("Haystackファイルを読み込み中...")
+            self.haystack, _ = librosa.load(haystack_path, sr=target_sr)
+            self.haystack_mean = float(np.mean(self.haystack))
+            self.haystack_std = float(np.std(self.haystack)) or 1.0
+            if hierarchical:
+                self.haystack_envelope = rms_envelope(self.haystack, self.hop)
+
+    def close(self):
+        """メモリマップを閉じ、キャッシュを使わずにデコードした一時ファイルを削除する"""
+        self.haystack = None
+        if self._decoded_path and os.path.exists(self._decoded_path):
+            try:
+                os.remove(self._decoded_path)
+            except OSError as e:
+                print(f"一時ファイルを削除できませんでした: {e}")
+        self._decoded_path = None
+
+    def _haystack_norm(self, start, end):
+        """haystack[start:end] を正規化した float32 のコピーを返す"""
+        return ((self.haystack[start:end] - self.haystack_mean) / self.haystack_std).astype(np.float32)
+
+    def _haystack_envelope_spectrum(self, nfft):
+        """haystack の包絡線の FFT。アンカーの長さが同じ間は使い回す"""
+        if self._envelope_spectrum[0] != nfft:
+            self._envelope_spectrum = (nfft, sp_fft.rfft(self.haystack_envelope, nfft))
+        return self._envelope_spectrum[1]
+
+    def _pick_coarse_lags(self, correlation):
+        """包絡線の相関から、アンカー位置の候補 (target_sr のサンプル単位) を相関の強い順に返す"""
+        correlation = correlation.copy()
+        exclusion = int(REFINE_RADIUS_SECONDS * self.target_sr / self.hop)
+        lags = []
+        for _ in range(COARSE_CANDIDATES):
+            peak = int(np.argmax(correlation))
+            if not np.isfinite(correlation[peak]):
+                break
+            lags.append(peak * self.hop)
+            correlation[max(0, peak - exclusion):peak + exclusion + 1] = -np.inf
+        return lags
+
+    def _coarse_lags(self, anchors_norm):
+        """
+        全アンカーの包絡線をまとめて1回のFFTにかけ、haystack の包絡線スペクトルとの相関から
+        アンカーごとの候補ラグのリストを返す。
+        """
+        envelopes = [rms_envelope(anchor_norm, self.hop) for anchor_norm in anchors_norm]
+        length = max(len(envelope) for envelope in envelopes)
+        n_lags = len(self.haystack_envelope) - length + 1
+        if n_lags <= 0:
+            return [[] for _ in anchors_norm]
+        stacked = np.zeros((len(envelopes), length), dtype=np.float32)
+        for row, envelope in zip(stacked, envelopes):
+            row[:len(envelope)] = envelope
+
+        nfft = sp_fft.next_fast_len(len(self.haystack_envelope) + length)
+        spectra = np.conj(sp_fft.rfft(stacked, nfft, axis=1)) * self._haystack_envelope_spectrum(nfft)
+        correlations = sp_fft.irfft(spectra, nfft, axis=1)[:, :n_lags]
+        return [self._pick_coarse_lags(correlation) for correlation in correlations]
+
+    def _search_window(self, anchor_norm, center_lag, radius):
+        """
+        center_lag の前後 radius サンプルだけを target_sr で相関させ、
+        (ラグ, 正規化相関, ピークの信頼度) を返す。範囲が haystack の外なら ラグは None。
+        """
+        window_start = max(0, center_lag - radius)
+        window = self._haystack_norm(window_start, max(0, center_lag + radius + len(anchor_norm)))
+        if len(window) < len(anchor_norm):
+            return None, 0.0, 0.0
+        correlation = correlate(window, anchor_norm, mode='valid')
+        peak = int(np.argmax(correlation))
+        matched = window[peak:peak + len(anchor_norm)]
+        score = correlation[peak] / (np.linalg.norm(matched) * np.linalg.norm(anchor_norm) + 1e-9)
+        confidence = _peak_confidence(correlation, peak, int(PEAK_EXCLUSION_SECONDS * self.target_sr))
+        return window_start + peak, score, confidence
+
+    def _overlap_save_search(self, anchors_norm):
+        """
+        haystack 全体を元のレートで各アンカーと相関させ、アンカーごとの (ラグ, 信頼度) を返す。
+        overlap-save 法で haystack をブロックごとにFFTするので、メモリ使用量は録音の長さによらない。
+        信頼度はピーク周辺を除かず、全ラグの平均・標準偏差で近似した PSR。
+        """
+        anchor_length = max(len(anchor_norm) for anchor_norm in anchors_norm)
+        n_lags = len(self.haystack) - anchor_length + 1
+        if n_lags <= 0:
+            return [(None, 0.0) for _ in anchors_norm]
+        nfft = sp_fft.next_fast_len(max(OVERLAP_SAVE_FFT_SIZE, 4 * anchor_length))
+        step = nfft - anchor_length + 1
+        stacked = np.zeros((len(anchors_norm), anchor_length), dtype=np.float32)
+        for row, anchor_norm in zip(stacked, anchors_norm):
+            row[:len(anchor_norm)] = anchor_norm
+        anchor_spectra = np.conj(sp_fft.rfft(stacked, nfft, axis=1))
+
+        best_values = np.full(len(anchors_norm), -np.inf)
+        best_lags = np.zeros(len(anchors_norm), dtype=np.int64)
+        totals = np.zeros(len(anchors_norm))
+        totals_sq = np.zeros(len(anchors_norm))
+        for block_start in range(0, n_lags, step):
+            block = self._haystack_norm(block_start, block_start + nfft)
+            valid = min(step, n_lags - block_start)
+            correlations = sp_fft.irfft(anchor_spectra * sp_fft.rfft(block, nfft), nfft, axis=1)[:, :valid]
+            peaks = np.argmax(correlations, axis=1)
+            values = correlations[np.arange(len(anchors_norm)), peaks]
+            improved = values > best_values
+            best_values[improved] = values[improved]
+            best_lags[improved] = block_start + peaks[improved]
+            totals += np.sum(correlations, axis=1, dtype=np.float64)
+            totals_sq += np.einsum('ij,ij->i', correlations, correlations)
+
+        means = totals / n_lags
+        stds = np.sqrt(np.maximum(totals_sq / n_lags - means ** 2, 0.0)) + 1e-9
+        return [(int(lag), float((value - mean) / std))
+                for lag, value, mean, std in zip(best_lags, best_values, means, stds)]
+
+    def _find_lags(self, anchors_norm):
+        """アンカーごとに haystack 全体から (ラグ, 信頼度) を求める"""
+        if not self.hierarchical:
+            return self._overlap_save_search(anchors_norm)
+        # 候補ごとに細かい探索を行い、正規化相関が最も高いものを採用する
+        radius = int(REFINE_RADIUS_SECONDS * self.target_sr)
+        results = []
+        for anchor_norm, lags in zip(anchors_norm, self._coarse_lags(anchors_norm)):
+            refined = [self._search_window(anchor_norm, lag, radius) for lag in lags]
+            refined = [result for result in refined if result[0] is not None]
+            if not refined:
+                results.append((None, 0.0))
+                continue
+            lag, _, confidence = max(refined, key=lambda result: result[1])
+            results.append((lag, confidence))
+        return results
+
+    def _anchor_offsets(self, anchor_starts, lags):
+        return [(lag - start if lag is not None else None, confidence)
+                for start, (lag, confidence) in zip(anchor_starts, lags)]
+
+    def find_offset(self, needle_audio, expected_offset=None, search_tolerance=None):
+        """
+        needle の波形 (target_sr) が haystack のどこから始まるかを計算する。
+        正の値はNeedleが遅れて始まることを、負の値はNeedleが先行して始まることを意味する。
+        expected_offset (秒) と search_tolerance (秒) を指定すると、その範囲の haystack だけを探索する。
+        範囲内のピークの信頼度が MIN_PEAK_CONFIDENCE に満たない場合は全体を探索し直す。
+        """
+        target_sr = self.target_sr
+
+        # 1. Needleから互いに重ならない複数のアンカー（特徴的な部分）を切り出す
+        anchors = find_anchors(needle_audio, target_sr, count=self.anchor_count)
+        anchor_starts = [start for _, start in anchors]
+
+        # 2. 音量を正規化
+        anchors_norm = [(anchor - np.mean(anchor)) / (np.std(anchor) + 1e-9) for anchor, _ in anchors]
+
+        # 3. クロス相関で各アンカーをHaystackから探し、アンカーごとのオフセットと信頼度 (PSR) を求める
+        offset_samples, confidence = None, 0.0
+        if expected_offset is not None and search_tolerance:
+            print(f"アンカーをHaystackの {expected_offset:.2f}秒 ±{search_tolerance:.1f}秒 の範囲で検索中...")
+            radius = int(search_tolerance * target_sr)
+            lags = []
+            for anchor_norm, start in zip(anchors_norm, anchor_starts):
+                lag, _, anchor_confidence = self._search_window(
+                    anchor_norm, int(round(expected_offset * target_sr)) + start, radius)
+                lags.append((lag, anchor_confidence))
+            offset_samples, confidence = _combine_anchor_results(self._anchor_offsets(anchor_starts, lags), target_sr)
+            if offset_samples is None or confidence < MIN_PEAK_CONFIDENCE:
+                print(f"範囲内のピークの信頼度が低いため (PSR {confidence:.1f})、Haystack全体を検索し直します。")
+                offset_samples = None
+        if offset_samples is None:
+            print(f"{len(anchors)}個のアンカーをHaystack内で検索中...")
+            lags = self._find_lags(anchors_norm)
+            offset_samples, confidence = _combine_anchor_results(self._anchor_offsets(anchor_starts, lags), target_sr)
+        if offset_samples is None:
+            raise ValueError("Haystack内にアンカーが見つかりませんでした。")
         
-        # 6. 最終的なオフセットを計算
+        # 4. 最終的なオフセットを計算
         #    Needleの開始位置 = (Haystackで見つかったアンカーの位置) - (Needle内でのアンカーの開始位置)
-        final_offset_samples = lag_in_haystack - anchor_start_in_needle
+        final_offset_samples = int(offset_samples)
         final_offset_seconds = float(final_offset_samples) / target_sr
 
-        print(f"\n計算完了: NeedleはHaystackの {final_offset_seconds:.4f} 秒地点から始まります。")
+        print(f"\n計算完了: NeedleはHaystackの {final_offset_seconds:.4f} 秒地点から始まります。(信頼度 PSR {confidence:.1f})")
         print(f"（正の値はNeedleが遅れて始まることを、負の値はNeedleが先行して始まることを意味します）")
         
         return {
             'offset_seconds': final_offset_seconds,
             'offset_samples': final_offset_samples,
+            'confidence': confidence,
         }
 
+    def find_offset_from_file(self, needle_path, expected_offset=None, search_tolerance=None):
+        print(f"対象音声 (needle): {os.path.basename(needle_path)}")
+        print("Needleファイルを読み込み中...")
+        needle_audio, _ = librosa.load(needle_path, sr=self.target_sr)
+        return self.find_offset(needle_audio, expected_offset, search_tolerance)
+
+def find_audio_offset(haystack_path, needle_path, target_sr, session=None, hierarchical=True,
+                      expected_offset=None, search_tolerance=None, cache_dir=None):
+    """
+    アンカー検索を用いて、2つの音声ファイルのオフセットを高精度に計算する。
+    同じ haystack に対して繰り返し呼ぶ場合は AudioSyncSession を渡すと、haystack の読み込みを省略できる。
+    expected_offset と search_tolerance で探索範囲を絞れる (AudioSyncSession.find_offset を参照)。
+    cache_dir を指定すると、デコード済みの音声をキャッシュしてメモリマップで読み込む。
+    """
+    owned_session = None
+    try:
+        if session is None:
+            session = owned_session = AudioSyncSession(haystack_path, target_sr, hierarchical, cache_dir=cache_dir)
+        if cache_dir:
+            print(f"対象音声 (needle): {os.path.basename(needle_path)}")
+            needle_audio = open_decoded_audio(needle_path, target_sr, cache_dir)[0]
+            return session.find_offset(needle_audio, expected_offset, search_tolerance)
+        return session.find_offset_from_file(needle_path, expected_offset, search_tolerance)
+
     except Exception as e:
         import traceback
         print(f"音声同期中にエラーが発生しました: {e}")
         traceback.print_exc()
         return None
+    finally:
+        if owned_session is not None:
+            owned_session.close()
 
-def plot_verification(haystack_path, needle_path, sr, offset_seconds):
+def plot_verification(haystack_path, needle_path, sr, offset_seconds, cache_dir=None):
 
     """
     検出されたオフセットに基づき、2つの波形をプロットして視覚的に一致を確認する。
+    cache_dir を指定すると、デコード済みの音声キャッシュをメモリマップで参照する。
     """
     print("一致検証のため、波形プロットを生成しています...")
     try:
         import matplotlib.pyplot as plt
         import librosa.display
         
-        needle_audio, _ = librosa.load(needle_path, sr=sr)
-        duration_seconds = librosa.get_duration(y=needle_audio, sr=sr)
-        
-        # オフセットとデュレーションを使って、haystackの該当部分を読み込む
-        haystack_segment, _ = librosa.load(
-            haystack_path,
-            sr=sr,
-            offset=offset_seconds,
-            duration=duration_seconds
-        )
+        if cache_dir:
+            needle_audio = open_decoded_audio(needle_path, sr, cache_dir)[0]
+            haystack_audio = open_decoded_audio(haystack_path, sr, cache_dir)[0]
+            start = max(0, int(round(offset_seconds * sr)))
+            haystack_segment = np.array(haystack_audio[start:start + len(needle_audio)])
+        else:
+            needle_audio, _ = librosa.load(needle_path, sr=sr)
+            duration_seconds = librosa.get_duration(y=needle_audio, sr=sr)
+            
+            # オフセットとデュレーションを使って、haystackの該当部分を読み込む
+            haystack_segment, _ = librosa.load(
+                haystack_path,
+                sr=sr,
+                offset=offset_seconds,
+                duration=duration_seconds
+            )
         
         fig, ax = plt.subplots(figsize=(18, 7))
         ax.set_title(f"Audio Alignment Verification (SR: {sr} Hz)")
@@ -119,9 +499,12 @@ def plot_verification(haystack_path, needle_path, sr, offset_seconds):
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description="2つの音声ファイルをクロス相関で同期させます。")
+    # 相対インポートを使うため、python -m cvcutter.sync_audio <haystack> <needle> として実行する
+    parser = argparse.ArgumentParser(prog="python -m cvcutter.sync_audio",
+                                     description="2つの音声ファイルをクロス相関で同期させます。")
     parser.add_argument('haystack', help="基準となる音声ファイルのパス (例: mic_audio.wav)")
     parser.add_argument('needle', help="同期させたい音声ファイルのパス (例: video_audio.wav)")
+    parser.add_argument('--cache-dir', help="デコード済み音声をキャッシュするディレクトリ (省略時はキャッシュしない)")
     args = parser.parse_args()
 
     if os.path.exists(args.haystack) and os.path.exists(args.needle):
@@ -129,7 +512,7 @@ if __name__ == '__main__':
         TARGET_SAMPLE_RATE = 22050
         
         # メインの同期処理を実行
-        sync_result = find_audio_offset(args.haystack, args.needle, TARGET_SAMPLE_RATE)
+        sync_result = find_audio_offset(args.haystack, args.needle, TARGET_SAMPLE_RATE, cache_dir=args.cache_dir)
         
         # 結果が得られた場合、グラフで視覚的に確認
         if sync_result:
@@ -137,7 +520,8 @@ if __name__ == '__main__':
                 args.haystack, 
                 args.needle, 
                 TARGET_SAMPLE_RATE, 
-                sync_result['offset_seconds']
+                sync_result['offset_seconds'],
+                cache_dir=args.cache_dir
             )
     else:
         print(f"エラー: ファイルが見つかりません '{args.haystack}' または '{args.needle}'")
\ No newline at end of file
@@ -1,33 +1,238 @@
 import os
 import re
+import json
+import hashlib
 import subprocess
 import shutil
+import tempfile
 import imageio_ffmpeg
+import multiprocessing
 import numpy as np
 from pathlib import Path
-try:
-    from moviepy.editor import VideoFileClip, AudioFileClip
-except ImportError:
-    from moviepy import VideoFileClip, AudioFileClip
-from .detect_performances import detect_performances_by_motion
-from .sync_audio import find_audio_offset
+from .detect_performances import iter_performances_by_motion
+from .sync_audio import AudioSyncSession, open_decoded_audio
 from tqdm import tqdm
 import time
-from .video_utils import concatenate_videos, get_gpu_args
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from .video_utils import get_gpu_args, file_fingerprint, extract_audio_pcm, probe_video, get_keyframe_times, \
+    get_source_spans, analyze_interlacing, VirtualTimeline
+
+# Settings that are stored flat in the 'processing' section but belong to detection_config.
+DETECTION_SETTING_KEYS = ('mog2_threshold', 'min_contour_area', 'min_duration_seconds',
+                          'left_zone_end_percent', 'center_zone_end_percent')
 
 # --- Core Logic Functions (from previous version) ---
 
-def get_consensus_offset(offsets, tolerance=1.0):
+def get_consensus_offset(offsets, tolerance=1.0, weights=None):
+    """
+    Pick the cluster of offsets (within tolerance of one another) with the largest total weight
+    and return its weighted mean. Without weights every measurement counts once.
+    """
     if not offsets: return None
-    sorted_offsets = sorted(offsets)
+    if weights is None:
+        weights = [1.0] * len(offsets)
+    sorted_pairs = sorted(zip(offsets, weights))
     best_cluster = []
-    for i in range(len(sorted_offsets)):
-        current_offset = sorted_offsets[i]
-        current_cluster = [o for o in sorted_offsets if abs(o - current_offset) <= tolerance]
-        if len(current_cluster) > len(best_cluster):
-            best_cluster = current_cluster
-    if not best_cluster: return np.median(sorted_offsets)
-    return np.mean(best_cluster)
+    best_support = 0.0
+    for current_offset, _ in sorted_pairs:
+        current_cluster = [(o, w) for o, w in sorted_pairs if abs(o - current_offset) <= tolerance]
+        support = sum(w for _, w in current_cluster)
+        if support > best_support:
+            best_cluster, best_support = current_cluster, support
+    if not best_cluster: return np.median(offsets)
+    return sum(o * w for o, w in best_cluster) / best_support
+
+# Drift is only fitted from at least this many agreeing segments spread over this many seconds;
+# otherwise a noisy slope from two nearby segments would be extrapolated over the whole concert.
+MIN_DRIFT_INLIERS = 3
+MIN_DRIFT_SPAN_SECONDS = 600
+# Camera/recorder clocks differ by tens of ppm; anything steeper is a bad fit.
+MAX_DRIFT = 1e-3
+MIN_MODEL_TOLERANCE = 0.25
+
+class OffsetModel:
+    """
+    Mic offset (mic time minus video time) as a linear function of video time:
+    offset(t) = intercept + drift * t, so clock drift between camera and recorder is followed
+    over a long concert instead of being collapsed into one global offset.
+    """
+
+    def __init__(self, intercept, drift=0.0, residual=0.0, inliers=0):
+        self.intercept = intercept
+        self.drift = drift
+        self.residual = residual
+        self.inliers = inliers
+
+    def predict(self, video_time):
+        return self.intercept + self.drift * video_time
+
+    def search_tolerance(self, default):
+        """Sync search half-width around the prediction: a few residuals, never wider than default."""
+        return min(default, max(MIN_MODEL_TOLERANCE, 4 * self.residual))
+
+    def __str__(self):
+        return f"{self.intercept:.4f} s {self.drift * 1e6:+.1f} ppm ({self.inliers} segments)"
+
+def fit_offset_model(times, offsets, weights=None, tolerance=1.0):
+    """
+    Fit an OffsetModel to per-segment measurements (segment start in video time, measured offset).
+    Inliers are the confidence-weighted consensus cluster; the line is fitted to them with
+    weighted least squares and refitted once on the points close to that first line.
+    Returns None when there are no measurements. When no cluster carries any weight (e.g. every
+    confidence is zero) the model falls back to the plain median offset with no inliers.
+    """
+    if not offsets:
+        return None
+    if weights is None:
+        weights = [1.0] * len(offsets)
+    times, offsets, weights = (np.asarray(v, dtype=np.float64) for v in (times, offsets, weights))
+    consensus = get_consensus_offset(list(offsets), tolerance, list(weights))
+    inliers = np.abs(offsets - consensus) <= tolerance
+    if not inliers.any():
+        median = float(np.median(offsets))
+        return OffsetModel(median, 0.0, float(np.median(np.abs(offsets - median))), 0)
+
+    def fit(mask):
+        t, y, w = times[mask], offsets[mask], np.maximum(weights[mask], 1e-6)
+        intercept, drift = np.average(y, weights=w), 0.0
+        if mask.sum() >= MIN_DRIFT_INLIERS and np.ptp(t) >= MIN_DRIFT_SPAN_SECONDS:
+            design = np.stack([np.ones_like(t), t], axis=1) * np.sqrt(w)[:, None]
+            (fitted_intercept, fitted_drift), *_ = np.linalg.lstsq(design, y * np.sqrt(w), rcond=None)
+            if abs(fitted_drift) <= MAX_DRIFT:
+                intercept, drift = fitted_intercept, fitted_drift
+        return intercept, drift
+
+    intercept, drift = fit(inliers)
+    residuals = np.abs(offsets - (intercept + drift * times))
+    # Measured against the line, drifting late segments rejoin and stray points drop out.
+    refined = residuals <= max(MIN_MODEL_TOLERANCE, 3 * np.median(residuals[inliers]))
+    if refined.sum() >= 2 and not np.array_equal(refined, inliers):
+        inliers = refined
+        intercept, drift = fit(inliers)
+        residuals = np.abs(offsets - (intercept + drift * times))
+    residual = float(np.sqrt(np.average(residuals[inliers] ** 2, weights=np.maximum(weights[inliers], 1e-6))))
+    return OffsetModel(float(intercept), float(drift), residual, int(inliers.sum()))
+
+DEINTERLACE_FILTERS = ('yadif', 'bwdif')
+
+def get_deinterlace_filter(config, interlacing):
+    """
+    The ffmpeg deinterlace filter for a source, from the deinterlace settings and the result of
+    analyze_interlacing, or None when frames should pass through untouched.
+    """
+    mode = config.get('deinterlace', 'auto')
+    if mode == 'off' or mode is False or (mode == 'auto' and not interlacing['interlaced']):
+        return None
+    name = config.get('deinterlace_filter', 'yadif')
+    if name not in DEINTERLACE_FILTERS:
+        print(f"Unknown deinterlace filter '{name}'. Using yadif.")
+        name = 'yadif'
+    field_mode = 'send_field' if config.get('deinterlace_field_rate') else 'send_frame'
+    return f"{name}=mode={field_mode}:parity={interlacing['parity'] or 'auto'}"
+
+# Encoder threads one concurrent segment encode is planned around when encode_workers is 'auto'.
+ENCODE_THREADS_PER_JOB = 4
+
+def get_encode_plan(config, gpu_args):
+    """
+    Return (concurrent segment encodes, ffmpeg -threads per encode).
+    'auto' runs one encode per ENCODE_THREADS_PER_JOB cores; an explicit encode_workers is the limit.
+    Hardware encoders have few sessions, so they are capped at max_gpu_encodes.
+    """
+    cores = os.cpu_count() or 1
+    setting = config.get('encode_workers', 'auto')
+    if setting == 'auto' or not setting:
+        workers = max(1, cores // ENCODE_THREADS_PER_JOB)
+    else:
+        workers = max(1, int(setting))
+    vcodec = gpu_args[gpu_args.index('-c:v') + 1]
+    if vcodec != 'libx264':
+        workers = min(workers, max(1, int(config.get('max_gpu_encodes', 2))))
+    return workers, max(1, cores // workers)
+
+class EncodeProgress:
+    """Sums the progress of concurrently running segment encodes into one progress_callback."""
+
+    def __init__(self, progress_callback):
+        self.progress_callback = progress_callback
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def add_job(self, key, duration):
+        with self.lock:
+            self.jobs[key] = [0.0, duration]
+
+    def _report(self, key, current_time):
+        with self.lock:
+            job = self.jobs[key]
+            job[0] = min(max(current_time, job[0]), job[1])
+            done = sum(d for d, _ in self.jobs.values())
+            total = sum(t for _, t in self.jobs.values())
+            running = sum(1 for d, t in self.jobs.values() if 0 < d < t)
+        if self.progress_callback:
+            self.progress_callback(done, total, f"Encoding {running} segment(s): {done:.0f} / {total:.0f} s")
+
+    def job_callback(self, key):
+        """progress_callback for run_ffmpeg_with_progress of one job."""
+        return lambda current_time, duration, message: self._report(key, current_time)
+
+    def finish(self, key):
+        self._report(key, self.jobs[key][1])
+
+def get_worker_count(value):
+    """Number of worker processes for a 'sync_workers'-style setting ('auto' or 0 means all cores)."""
+    value = value or 1
+    if value == 'auto' or value == 0:
+        value = os.cpu_count() or 1
+    return max(1, int(value))
+
+# Per-process sync session of the parallel sync pool, opened once by _init_sync_worker.
+_worker_session = None
+
+def _init_sync_worker(mic_audio_path, sample_rate, cache_dir):
+    """Pool initializer: memory-map the already decoded mic track instead of receiving a pickled copy."""
+    global _worker_session
+    _worker_session = AudioSyncSession(mic_audio_path, sample_rate, cache_dir=cache_dir)
+
+def _sync_segment_in_worker(config, i, start_time, end_time, expected_offset, search_tolerance):
+    return sync_segment(config, _worker_session, i, start_time, end_time,
+                        expected_offset=expected_offset, search_tolerance=search_tolerance)
+
+# detection_config keys that change how detection runs but not which segments it finds.
+DETECTION_CACHE_IGNORED_KEYS = ('show_video', 'num_workers', 'feature_cache', 'feature_cache_dir')
+
+def get_detection_cache_path(video_paths, detection_config, temp_dir):
+    """
+    Location of the cached segment list for these source videos and detection settings.
+    The key is the fingerprint of every source file plus the detection config, so edited
+    or replaced files and changed parameters never hit a stale entry.
+    """
+    key_config = {k: v for k, v in detection_config.items() if k not in DETECTION_CACHE_IGNORED_KEYS}
+    key = hashlib.sha1(json.dumps({
+        'sources': [file_fingerprint(p) for p in video_paths],
+        'detection_config': key_config,
+    }, sort_keys=True).encode()).hexdigest()
+    return os.path.join(temp_dir, 'detection_cache', f"{key}.json")
+
+def load_cached_segments(cache_path):
+    """Return the cached list of (start, end) segments, or None if there is no usable entry."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return [tuple(seg) for seg in json.load(f)['segments']]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable detection cache {cache_path}: {e}")
+        return None
+
+def save_cached_segments(cache_path, video_paths, segments):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'sources': [os.path.basename(p) for p in video_paths],
+                   'segments': [list(seg) for seg in segments]}, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
 
 def run_ffmpeg_with_progress(command, duration, progress_callback=None):
     """
@@ -102,15 +307,16 @@ def process_pair(video_paths, audio_path, config_overrides, progress_callback=No
 
     audio_path = str(audio_path) if audio_path else None
 
-    # Handle concatenation if multiple videos provided
+    # A recording split across several files is read through a virtual timeline: detection and
+    # sync see one continuous video via ffmpeg's concat demuxer, and each segment is encoded
+    # straight from the file it lies in. Nothing is joined into an intermediate file.
+    # A single file is used as is, so it doesn't need a readable duration up front.
+    timeline = None
     if len(video_paths) > 1:
-        update_status("Concatenating video segments...")
-        concat_video_path = os.path.join(config_overrides.get('temp_dir', 'temp'), "concatenated_input.mp4")
-        if not concatenate_videos(video_paths, concat_video_path):
-            print("Failed to concatenate videos. Using only the first one.")
-            video_path = video_paths[0]
-        else:
-            video_path = concat_video_path
+        timeline = VirtualTimeline(video_paths)
+        video_path = timeline.write_concat_list(config_overrides.get('temp_dir', 'temp'))
+        for path, start, duration in zip(timeline.paths, timeline.starts, timeline.durations):
+            print(f"  {os.path.basename(path)}: {start:.2f}s - {start + duration:.2f}s")
     else:
         video_path = video_paths[0]
 
@@ -128,88 +334,538 @@ def process_pair(video_paths, audio_path, config_overrides, progress_callback=No
         'video_audio_volume': 0.6,
         'mic_audio_volume': 1.5,
         'audio_sync_sample_rate': 22050,
+        'sync_search_tolerance': 2.0,
+        'sync_workers': 'auto',
+        'encode_workers': 'auto',
+        'max_gpu_encodes': 2,
+        # 'reencode' encodes every segment in full; 'smart_cut' stream-copies the camera's
+        # H.264 between the first and last keyframe of each segment and only re-encodes the edges;
+        # 'batch' waits for all segments and writes them from one decode of the source.
+        'output_mode': 'reencode',
+        # 'auto' deinterlaces only sources analyze_interlacing finds interlaced; 'always' / 'off' force it.
+        'deinterlace': 'auto',
+        'deinterlace_filter': 'yadif',  # or 'bwdif': slower, sharper on motion
+        'deinterlace_field_rate': False,  # one output frame per field (e.g. 60i to 60p)
         'use_gpu': True,
+        # The faster detection modes (analysis_width, analysis_fps, num_workers, frame_source='ffmpeg',
+        # audio_prepass) are opt-in through detection_config; the defaults keep today's boundaries.
         'detection_config': { 'max_seconds_to_process': None, 'min_duration_seconds': 30, 'show_video': False,
+                              'feature_cache': True,
                               'mog2_threshold': 40, 'min_contour_area': 3000, 'left_zone_end_percent': 0.15,
                               'center_zone_end_percent': 0.65 } # 誤検知減少のためここを変更すべし
     }
     config.update(config_overrides)
+    # Detection parameters edited in the settings tab arrive as top-level keys.
+    config['detection_config'] = dict(
+        config['detection_config'],
+        **{key: config_overrides[key] for key in DETECTION_SETTING_KEYS if key in config_overrides}
+    )
+    # Motion timelines go to temp_dir rather than next to the user's source videos.
+    config['detection_config'].setdefault('feature_cache_dir', os.path.join(config['temp_dir'], 'motion_timeline'))
 
     os.makedirs(config['output_dir'], exist_ok=True)
     os.makedirs(config['temp_dir'], exist_ok=True)
 
+    # --- Source analysis: deinterlace only footage that is actually interlaced ---
+    interlacing = analyze_interlacing(config['video_path'], os.path.join(config['temp_dir'], 'interlace'))
+    config['video_filter'] = get_deinterlace_filter(config, interlacing)
+    scan = f"interlaced ({interlacing['parity'] or 'unknown parity'})" if interlacing['interlaced'] else 'progressive'
+    print(f"Source is {scan}"
+          f" (idet {interlacing['idet']}); video filter: {config['video_filter'] or 'none'}")
+    config['detection_config'].setdefault('deinterlace', interlacing['interlaced'])
+
     # --- Step 1: Detect Segments ---
-    update_status(f"Detecting segments for {os.path.basename(video_path)}...")
-    performance_segments = detect_performances_by_motion(config['video_path'], config['detection_config'])
+    # Keyed on the original source files.
+    cache_path = get_detection_cache_path(video_paths, config['detection_config'], config['temp_dir'])
+    cached_segments = load_cached_segments(cache_path)
+    if cached_segments is not None:
+        print(f"Using cached detection result: {cache_path}")
+        segment_source = iter(cached_segments)
+    else:
+        update_status(f"Detecting segments for {os.path.basename(video_path)}...")
+        segment_source = iter_performances_by_motion(config['video_path'], config['detection_config'])
+
+    # --- Steps 2 & 3: Sync and encode each segment as soon as detection yields it ---
+    base_name = os.path.splitext(os.path.basename(base_name_source_path))[0]
+    gpu_args = get_gpu_args() if config.get('use_gpu') else ['-c:v', 'libx264', '-preset', 'medium']
+
+    # Several segments encode at once, each with its share of the cores.
+    encode_workers, encode_threads = get_encode_plan(config, gpu_args)
+    encode_args = gpu_args + ['-threads', str(encode_threads)]
+    print(f"Encoding up to {encode_workers} segment(s) at once with {encode_threads} thread(s) each.")
+    encode_progress = EncodeProgress(progress_callback)
+
+    # Smart-cut probe and keyframe index of each file segments are cut from, prepared on first use.
+    smart_cut_infos = {}
+    smart_cut_lock = threading.Lock()
+
+    sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sync')
+    encode_executor = ThreadPoolExecutor(max_workers=encode_workers, thread_name_prefix='encode')
+    sync_workers = get_worker_count(config.get('sync_workers'))
+    audio_cache_dir = os.path.join(config['temp_dir'], 'audio_cache')
+    sync_futures = []
+    encode_futures = []
+    all_offsets = []
+    # Peak-to-sidelobe confidence of each measurement, used to weight the consensus.
+    all_confidences = []
+    # Video time of each measurement, for the drift-aware offset model.
+    all_times = []
+    # Segments to write in one ffmpeg run when output_mode is 'batch'.
+    batch_jobs = []
+    # Synced segments wait here until at least two measurements agree on the offset,
+    # so a single bad correlation early in the concert cannot ruin the first outputs.
+    pending_encodes = []
+    sync_state = {'session': None, 'pool': None, 'submitted': 0, 'done': 0}
+    # Sync results arrive on the pool's callback thread when syncing in parallel.
+    sync_lock = threading.Lock()
+
+    def run_encode(i, start_time, end_time, mic_offset, output_filename):
+        try:
+            if config.get('output_mode') == 'smart_cut':
+                if timeline is not None:
+                    source = timeline.source_range(start_time, end_time)
+                else:
+                    source = (video_path, start_time, end_time)
+                if source is not None:
+                    # Cut from the one file the segment lies in, on that file's own clock. The mic
+                    # offset moves with it so the mic start stays the same.
+                    path, local_start, local_end = source
+                    segment_config = dict(config, video_path=path)
+                    if mic_offset is not None:
+                        mic_offset += start_time - local_start
+                    with smart_cut_lock:
+                        if path not in smart_cut_infos:
+                            smart_cut_infos[path] = prepare_smart_cut(segment_config)
+                    if smart_cut_infos[path] is not None:
+                        return smart_cut_segment(segment_config, i, local_start, local_end, mic_offset,
+                                                 smart_cut_infos[path], encode_args, output_filename,
+                                                 update_status, encode_progress.job_callback(i))
+                    return encode_segment(segment_config, i, local_start, local_end, mic_offset, encode_args,
+                                          output_filename, update_status, encode_progress.job_callback(i))
+                print(f"Segment {i+1} spans two source files. Re-encoding it.")
+            return encode_segment(config, i, start_time, end_time, mic_offset, encode_args, output_filename,
+                                  update_status, encode_progress.job_callback(i))
+        finally:
+            encode_progress.finish(i)
+
+    def submit_encode(i, start_time, end_time, mic_offset):
+        output_filename = os.path.join(config['output_dir'], f"{base_name}_performance_{i+1}.mp4")
+        if config.get('output_mode') == 'batch':
+            batch_jobs.append((i, start_time, end_time, mic_offset, output_filename))
+            return
+        encode_progress.add_job(i, end_time - start_time)
+        encode_futures.append(encode_executor.submit(
+            run_encode, i, start_time, end_time, mic_offset, output_filename))
+
+    def established_model():
+        """The offset model once at least two measurements agree, else None."""
+        model = fit_offset_model(all_times, all_offsets, all_confidences)
+        return model if model is not None and model.inliers >= 2 else None
+
+    def flush_pending_encodes(final=False):
+        model = established_model()
+        if model is None:
+            if not final:
+                return
+            model = fit_offset_model(all_times, all_offsets, all_confidences)
+        for i, start_time, end_time in pending_encodes:
+            # Each segment gets the mic offset the model predicts at its own position in the video.
+            submit_encode(i, start_time, end_time, model.predict(start_time) if model else None)
+        pending_encodes.clear()
+
+    def record_sync_result(i, start_time, end_time, offset, confidence):
+        with sync_lock:
+            sync_state['done'] += 1
+            if offset is not None:
+                all_offsets.append(offset)
+                all_confidences.append(confidence)
+                all_times.append(start_time)
+                print(f"Segment {i+1} offset: {offset:.4f} s, confidence {confidence:.1f} "
+                      f"(model so far: {fit_offset_model(all_times, all_offsets, all_confidences)})")
+            message = (f"Synced segment {i+1} of {os.path.basename(video_path)} "
+                       f"({sync_state['done']}/{sync_state['submitted']} done)")
+            # Report numeric progress; update_status's (0, 0) would reset the progress bar.
+            if progress_callback:
+                progress_callback(sync_state['done'], sync_state['submitted'], message)
+            print(message)
+            pending_encodes.append((i, start_time, end_time))
+            flush_pending_encodes()
+
+    def on_synced(future, i, start_time, end_time):
+        try:
+            offset, confidence = future.result()
+        except Exception as e:
+            print(f"  ERROR: Sync failed for segment {i+1}: {e}")
+            offset, confidence = None, 0.0
+        record_sync_result(i, start_time, end_time, offset, confidence)
+
+    def sync_and_schedule(i, start_time, end_time):
+        if not config['mic_audio_path']:
+            with sync_lock:
+                submit_encode(i, start_time, end_time, None)
+            return
+        update_status(f"Syncing segment {i+1} of {os.path.basename(video_path)}...")
+        with sync_lock:
+            sync_state['submitted'] += 1
+            # Once the offset is established, later segments only search around the model's
+            # prediction for their position, in a window sized from the model's residual.
+            model = established_model()
+            expected_offset = model.predict(start_time) if model else None
+            search_tolerance = model.search_tolerance(config['sync_search_tolerance']) if model else None
+
+        if sync_workers > 1:
+            try:
+                if sync_state['pool'] is None:
+                    # Decode the mic track into the cache up front so every worker just memory-maps it.
+                    open_decoded_audio(config['mic_audio_path'], config['audio_sync_sample_rate'], audio_cache_dir)
+                    # Spawn rather than fork: this process is multi-threaded (detection, encoders, GUI),
+                    # and a forked child can inherit a lock some other thread was holding.
+                    sync_state['pool'] = ProcessPoolExecutor(
+                        max_workers=sync_workers, mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_sync_worker,
+                        initargs=(config['mic_audio_path'], config['audio_sync_sample_rate'], audio_cache_dir))
+                future = sync_state['pool'].submit(_sync_segment_in_worker, config, i, start_time, end_time,
+                                                   expected_offset, search_tolerance)
+            except Exception as e:
+                print(f"  ERROR: Sync failed for segment {i+1}: {e}")
+                record_sync_result(i, start_time, end_time, None, 0.0)
+                return
+            future.add_done_callback(lambda f, i=i, s=start_time, e=end_time: on_synced(f, i, s, e))
+            return
+
+        try:
+            # The mic recording is decoded once into temp_dir/audio_cache (reused across runs and
+            # pairs sharing the recorder track), memory-mapped and reused for every segment.
+            if sync_state['session'] is None:
+                sync_state['session'] = AudioSyncSession(config['mic_audio_path'], config['audio_sync_sample_rate'],
+                                                         cache_dir=audio_cache_dir)
+            offset, confidence = sync_segment(config, sync_state['session'], i, start_time, end_time,
+                                              expected_offset=expected_offset, search_tolerance=search_tolerance)
+        except Exception as e:
+            print(f"  ERROR: Sync failed for segment {i+1}: {e}")
+            offset, confidence = None, 0.0
+        record_sync_result(i, start_time, end_time, offset, confidence)
+
+    performance_segments = []
+    try:
+        for i, (start_time, end_time) in enumerate(segment_source):
+            performance_segments.append((start_time, end_time))
+            print(f"\nPerformance segment {i+1} ready: {start_time:.2f}s - {end_time:.2f}s")
+            sync_futures.append(sync_executor.submit(sync_and_schedule, i, start_time, end_time))
+        # Detection is complete at this point; cache it before waiting on sync and encoding,
+        # so a failure or cancellation there doesn't throw the detection away.
+        if cached_segments is None:
+            save_cached_segments(cache_path, video_paths, performance_segments)
+    finally:
+        sync_executor.shutdown(wait=True)
+        if sync_state['pool'] is not None:
+            sync_state['pool'].shutdown(wait=True)
+        if sync_state['session'] is not None:
+            sync_state['session'].close()
+
+        if config['mic_audio_path'] and performance_segments:
+            if not all_offsets:
+                print("Audio synchronization failed. Falling back to video audio only.")
+            else:
+                print(f"\nFinal offset model: {fit_offset_model(all_times, all_offsets, all_confidences)}")
+        flush_pending_encodes(final=True)
+        encode_executor.shutdown(wait=True)
+        for group in get_batch_groups(config, batch_jobs, gpu_args):
+            encode_batch(config, group, gpu_args, update_status, encode_progress)
+
+    for future in sync_futures + encode_futures:
+        if future.exception() is not None:
+            print(f"  ERROR: {future.exception()}")
+
     if not performance_segments:
         print("\nNo performance segments found. Skipping to next pair.")
         return
-    print(f"\nDetected {len(performance_segments)} performance segments.")
-
-    # --- Step 2: Sync ---
-    global_offset = 0
-    if config['mic_audio_path']:
-        update_status(f"Syncing audio for {os.path.basename(video_path)}...")
-        all_offsets = []
-
-        # We need to handle MoviePy not blocking the UI if possible, but here it runs in the thread
-        with VideoFileClip(config['video_path']) as video:
-            for i, (start, end) in enumerate(performance_segments):
-                needle_path = os.path.join(config['temp_dir'], f'needle_{i+1}.wav')
-                # Extract audio for sync
-                video.audio.subclip(start, end).write_audiofile(needle_path, fps=config['audio_sync_sample_rate'], logger=None)
-
-                sync_result = find_audio_offset(config['mic_audio_path'], needle_path, config['audio_sync_sample_rate'])
-                if sync_result:
-                    all_offsets.append(sync_result['offset_seconds'] - start)
-
-                # Simple progress update
+    print(f"\nProcessed {len(performance_segments)} performance segments.")
+
+def sync_segment(config, session, i, start_time, end_time, expected_offset=None, search_tolerance=None):
+    """
+    Measure mic time minus video time for one segment.
+    Returns (offset, confidence), or (None, 0.0) if sync failed.
+    expected_offset (same convention) restricts the search to search_tolerance seconds around it
+    (sync_search_tolerance when not given).
+    """
+    # Decode the segment's audio straight from the video at the sync rate.
+    needle_audio = extract_audio_pcm(config['video_path'], config['audio_sync_sample_rate'],
+                                     start=start_time, duration=end_time - start_time)
+    print(f"Segment {i+1}: extracted {len(needle_audio) / config['audio_sync_sample_rate']:.1f}s of video audio for sync")
+
+    expected_mic_start = start_time + expected_offset if expected_offset is not None else None
+    sync_result = session.find_offset(needle_audio, expected_offset=expected_mic_start,
+                                      search_tolerance=search_tolerance or config.get('sync_search_tolerance'))
+    if not sync_result:
+        return None, 0.0
+    return sync_result['offset_seconds'] - start_time, sync_result['confidence']
+
+def build_source_inputs(video_path, start_time, end_time):
+    """
+    ffmpeg inputs for [start_time, end_time) of a video or VirtualTimeline list.
+    Each source file the range touches is opened directly at its local time and the files are
+    joined with the concat filter. Returns (input args, filters, video label, audio label, input count).
+    """
+    spans = get_source_spans(video_path, start_time, end_time)
+    args = []
+    for path, local_start, local_end in spans:
+        args += ['-ss', str(local_start), '-t', str(local_end - local_start), '-i', path]
+    if len(spans) == 1:
+        return args, [], '[0:v]', '[0:a]', 1
+    joined = ''.join(f"[{k}:v][{k}:a]" for k in range(len(spans))) + f"concat=n={len(spans)}:v=1:a=1[vsrc][asrc]"
+    return args, [joined], '[vsrc]', '[asrc]', len(spans)
+
+def build_segment_command(config, start_time, end_time, mic_offset, gpu_args, output_filename):
+    """
+    Build the ffmpeg command that cuts one segment, deinterlaces it when the source needs it
+    (config['video_filter']) and mixes in the mic recording when mic_offset (mic time minus
+    video time) is known.
+    """
+    duration = end_time - start_time
+
+    vcodec_idx = gpu_args.index('-c:v') + 1
+    vcodec = gpu_args[vcodec_idx]
+    extra_args = gpu_args[vcodec_idx+1:]
+
+    # Base command with the source file(s) the segment lies in
+    inputs, filters, video, audio, input_count = build_source_inputs(config['video_path'], start_time, end_time)
+    command = ['ffmpeg', '-y'] + inputs
+    filters.append(f"{video}{config.get('video_filter', 'yadif') or 'null'}[vout]")
+
+    mic_start = start_time + mic_offset if mic_offset is not None else None
+    if mic_start is not None and mic_start < 0:
+        print(f"Warning: Mic start time {mic_start} is negative for segment starting at {start_time:.2f}s. Skipping sync for this segment.")
+        # Fallback for this segment
+        mic_start = None
+    if mic_start is not None:
+        command += ['-ss', str(mic_start), '-i', config['mic_audio_path']]
+        filters.append(f"{audio}volume={config['video_audio_volume']}[a0];"
+                       f"[{input_count}:a]volume={config['mic_audio_volume']}[a1];[a0][a1]amix=inputs=2[aout]")
+    else:
+        # Video audio only
+        filters.append(f"{audio}anull[aout]")
+
+    command += ['-t', str(duration), '-filter_complex', ';'.join(filters), '-map', '[vout]', '-map', '[aout]',
+                '-c:v', vcodec] + extra_args + ['-c:a', 'aac', '-b:a', '192k', output_filename]
+    return command
+
+def encode_segment(config, i, start_time, end_time, mic_offset, gpu_args, output_filename,
+                   update_status, progress_callback=None):
+    update_status(f"Encoding segment {i+1} of {os.path.basename(config['video_path'])}...")
+    command = build_segment_command(config, start_time, end_time, mic_offset, gpu_args, output_filename)
+    return run_ffmpeg_with_progress(command, end_time - start_time, progress_callback)
+
+# Source profiles as ffmpeg prints them, mapped to libx264's -profile:v names.
+X264_PROFILES = {'constrained baseline': 'baseline', 'baseline': 'baseline', 'main': 'main',
+                 'high': 'high', 'high 10': 'high10', 'high 4:2:2': 'high422', 'high 4:4:4 predictive': 'high444'}
+
+def prepare_smart_cut(config):
+    """
+    Probe the source and index its keyframes for smart-cut output.
+    Returns the probe info with a 'keyframes' list, or None when the source cannot be stream-copied
+    (then every segment is re-encoded as usual).
+    """
+    info = probe_video(config['video_path'])
+    if info['video_codec'] != 'h264':
+        print(f"Smart cut needs an H.264 source (got {info['video_codec']}). Re-encoding segments instead.")
+        return None
+    if config.get('video_filter'):
+        print("Smart cut copies the camera stream, so the output stays interlaced.")
+    print("Indexing keyframes for smart cut...")
+    info['keyframes'] = get_keyframe_times(config['video_path'], os.path.join(config['temp_dir'], 'keyframes'))
+    print(f"  {len(info['keyframes'])} keyframes found.")
+    return info
+
+def get_smart_cut_range(start_time, end_time, keyframes):
+    """
+    (first keyframe at or after start_time, last keyframe at or before end_time), or None when the
+    segment holds fewer than two keyframes and there is nothing worth copying.
+    """
+    inside = [t for t in keyframes if start_time <= t <= end_time]
+    if len(inside) < 2:
+        return None
+    return inside[0], inside[-1]
+
+def build_edge_command(config, info, start_time, end_time, gpu_args, output_filename):
+    """Re-encode [start_time, end_time) of the video only, matching the source stream so it can be joined."""
+    command = ['ffmpeg', '-y', '-ss', str(start_time), '-i', config['video_path'],
+               '-t', str(end_time - start_time), '-map', '0:v:0', '-an',
+               '-c:v', 'libx264', '-preset', 'fast', '-crf', '18',
+               # SPS/PPS in-band on every keyframe, so they still apply after the parts are joined.
+               '-x264-params', 'repeat-headers=1']
+    if info['pix_fmt']:
+        command += ['-pix_fmt', info['pix_fmt']]
+    profile = X264_PROFILES.get((info['video_profile'] or '').lower())
+    if profile:
+        command += ['-profile:v', profile]
+    if info['field_order'] in ('tt', 'tb', 'bb', 'bt'):
+        # Keep the edges interlaced like the copied middle part.
+        command += ['-flags', '+ildct+ilme', '-top', '1' if info['field_order'] in ('tt', 'tb') else '0']
+    if '-threads' in gpu_args:
+        command += gpu_args[gpu_args.index('-threads'):gpu_args.index('-threads') + 2]
+    return command + ['-f', 'matroska', output_filename]
+
+def build_smart_cut_commands(config, info, start_time, end_time, mic_offset, gpu_args, work_dir, output_filename):
+    """
+    Commands for a smart cut of one segment, as (command, duration) pairs to run in order:
+    the re-encoded head up to the first keyframe, the stream-copied middle, the re-encoded tail,
+    and the final mux that joins them and mixes the audio like build_segment_command.
+    Returns None when the segment has no keyframe range to copy.
+    """
+    cut = get_smart_cut_range(start_time, end_time, info['keyframes'])
+    if cut is None:
+        return None
+    first_key, last_key = cut
+    duration = end_time - start_time
+    commands = []
+    parts = []
+
+    if first_key - start_time > 0.001:
+        parts.append(os.path.join(work_dir, 'head.mkv'))
+        commands.append((build_edge_command(config, info, start_time, first_key, gpu_args, parts[-1]),
+                         first_key - start_time))
+    parts.append(os.path.join(work_dir, 'middle.mkv'))
+    # Seeking a hair past the keyframe still lands on it; the copy then starts exactly there.
+    commands.append((['ffmpeg', '-y', '-ss', str(first_key + 0.001), '-i', config['video_path'],
+                      '-t', str(last_key - first_key), '-map', '0:v:0', '-an', '-c:v', 'copy',
+                      '-bsf:v', 'h264_mp4toannexb', '-f', 'matroska', parts[-1]], last_key - first_key))
+    if end_time - last_key > 0.001:
+        parts.append(os.path.join(work_dir, 'tail.mkv'))
+        commands.append((build_edge_command(config, info, last_key, end_time, gpu_args, parts[-1]),
+                         end_time - last_key))
+
+    list_path = os.path.join(work_dir, 'parts.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for part in parts:
+            f.write(f"file '{Path(part).resolve().as_posix()}'\n")
+
+    command = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path,
+               '-ss', str(start_time), '-i', config['video_path']]
+    mic_start = start_time + mic_offset if mic_offset is not None else None
+    if mic_start is not None and mic_start < 0:
+        print(f"Warning: Mic start time {mic_start} is negative for segment starting at {start_time:.2f}s. Skipping sync for this segment.")
+        mic_start = None
+    if mic_start is not None:
+        command += ['-ss', str(mic_start), '-i', config['mic_audio_path'], '-t', str(duration), '-filter_complex',
+                    f"[1:a]volume={config['video_audio_volume']}[a0];[2:a]volume={config['mic_audio_volume']}[a1];[a0][a1]amix=inputs=2[aout]",
+                    '-map', '0:v', '-map', '[aout]']
+    else:
+        command += ['-t', str(duration), '-map', '0:v', '-map', '1:a']
+    command += ['-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k', '-movflags', '+faststart', output_filename]
+    commands.append((command, duration))
+    return commands
+
+def smart_cut_segment(config, i, start_time, end_time, mic_offset, info, gpu_args, output_filename,
+                      update_status, progress_callback=None):
+    """
+    Write one segment with smart cut, falling back to encode_segment when there is no keyframe range.
+    Note that the copied part keeps the camera's stream as is, so it is not deinterlaced.
+    """
+    work_dir = tempfile.mkdtemp(prefix=f"smartcut_{i+1}_", dir=config['temp_dir'])
+    try:
+        commands = build_smart_cut_commands(config, info, start_time, end_time, mic_offset, gpu_args,
+                                            work_dir, output_filename)
+        if commands is None:
+            print(f"Segment {i+1} has no keyframe range to copy. Re-encoding it.")
+            return encode_segment(config, i, start_time, end_time, mic_offset, gpu_args, output_filename,
+                                  update_status, progress_callback)
+
+        update_status(f"Smart-cutting segment {i+1} of {os.path.basename(config['video_path'])}...")
+        # Parts together cover the segment once and the mux covers it again: report each half.
+        total = sum(part_duration for _, part_duration in commands)
+        done = 0.0
+        for command, part_duration in commands:
+            def part_progress(current_time, _duration, message, base=done):
                 if progress_callback:
-                    progress_callback(i+1, len(performance_segments), f"Syncing segment {i+1}/{len(performance_segments)}")
+                    progress_callback((base + current_time) * (end_time - start_time) / total,
+                                      end_time - start_time, message)
+            if not run_ffmpeg_with_progress(command, part_duration, part_progress):
+                return False
+            done += part_duration
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-        if not all_offsets:
-            print("Audio synchronization failed. Falling back to video audio only.")
-            config['mic_audio_path'] = None
-        else:
-            global_offset = get_consensus_offset(all_offsets)
-            print(f"\nFinal consensus global time offset: {global_offset:.4f} seconds")
+def get_batch_groups(config, jobs, gpu_args):
+    """
+    Split batch jobs into the groups written by one ffmpeg run each, in video order.
+    libx264 takes all segments at once; hardware encoders get at most max_gpu_encodes outputs per run.
+    """
+    jobs = sorted(jobs, key=lambda job: job[1])
+    if not jobs:
+        return []
+    size = len(jobs)
+    if gpu_args[gpu_args.index('-c:v') + 1] != 'libx264':
+        size = max(1, int(config.get('max_gpu_encodes', 2)))
+    return [jobs[k:k + size] for k in range(0, len(jobs), size)]
 
-    # --- Step 3: Process with FFMPEG ---
-    for i, (start_time, end_time) in enumerate(performance_segments):
-        duration = end_time - start_time
-        base_name = os.path.splitext(os.path.basename(base_name_source_path))[0]
-        output_filename = os.path.join(config['output_dir'], f"{base_name}_performance_{i+1}.mp4")
+def build_batch_command(config, jobs, gpu_args):
+    """
+    Build one ffmpeg command that writes several segments from a single pass over the source.
+    jobs are (i, start_time, end_time, mic_offset, output_filename). The video (each source file
+    of a VirtualTimeline) and the mic are opened once; split/asplit fan them out to a trim/atrim per segment, and each segment is
+    deinterlaced and mixed like build_segment_command.
+    """
+    vcodec_idx = gpu_args.index('-c:v') + 1
+    vcodec = gpu_args[vcodec_idx]
+    extra_args = gpu_args[vcodec_idx+1:]
 
-        update_status(f"Encoding segment {i+1} of {os.path.basename(video_path)}...")
+    base = min(start for _, start, _, _, _ in jobs)
+    end = max(end_time for _, _, end_time, _, _ in jobs)
+    mic_starts = {}
+    for i, start_time, _, mic_offset, _ in jobs:
+        if mic_offset is None:
+            continue
+        if start_time + mic_offset < 0:
+            print(f"Warning: Mic start time {start_time + mic_offset} is negative for segment starting at {start_time:.2f}s. Skipping sync for this segment.")
+            continue
+        mic_starts[i] = start_time + mic_offset
 
-        # Base command with input video
-        command = ['ffmpeg', '-y']
-        
-        # Check for GPU acceleration
-        gpu_args = get_gpu_args() if config.get('use_gpu') else ['-c:v', 'libx264', '-preset', 'medium']
-        vcodec_idx = gpu_args.index('-c:v') + 1
-        vcodec = gpu_args[vcodec_idx]
-        extra_args = gpu_args[vcodec_idx+1:]
-
-        if config['mic_audio_path']:
-            mic_start = start_time + global_offset
-            if mic_start < 0:
-                print(f"Warning: Mic start time {mic_start} is negative for segment {i+1}. Skipping sync for this segment.")
-                # Fallback for this segment
-                command += ['-ss', str(start_time), '-i', config['video_path'], '-t', str(duration),
-                            '-map', '0:v', '-map', '0:a', '-vf', 'yadif', '-c:v', vcodec] + extra_args + \
-                           ['-c:a', 'aac', '-b:a', '192k', output_filename]
-            else:
-                command += ['-ss', str(start_time), '-i', config['video_path'],
-                            '-ss', str(mic_start), '-i', config['mic_audio_path'],
-                            '-t', str(duration), '-filter_complex',
-                            f"[0:a]volume={config['video_audio_volume']}[a0];[1:a]volume={config['mic_audio_volume']}[a1];[a0][a1]amix=inputs=2[aout]",
-                            '-map', '0:v', '-map', '[aout]', '-vf', 'yadif', '-c:v', vcodec] + extra_args + \
-                           ['-c:a', 'aac', '-b:a', '192k', output_filename]
+    inputs, filters, video, audio, input_count = build_source_inputs(config['video_path'], base, end)
+    command = ['ffmpeg', '-y'] + inputs
+    mic_base = min(mic_starts.values()) if mic_starts else 0.0
+    if mic_starts:
+        command += ['-ss', str(mic_base), '-i', config['mic_audio_path']]
+
+    n = len(jobs)
+    filters += [f"{video}split={n}" + ''.join(f"[v{k}]" for k in range(n)),
+                f"{audio}asplit={n}" + ''.join(f"[a{k}]" for k in range(n))]
+    if mic_starts:
+        filters.append(f"[{input_count}:a]asplit={len(mic_starts)}" + ''.join(f"[m{k}]" for k in range(len(mic_starts))))
+    outputs = []
+    mic_index = 0
+    for k, (i, start_time, end_time, _, output_filename) in enumerate(jobs):
+        # Input timestamps start at zero from the -ss seek points.
+        trim = f"start={start_time - base}:end={end_time - base}"
+        filters.append(f"[v{k}]trim={trim},setpts=PTS-STARTPTS,{config.get('video_filter', 'yadif') or 'null'}[vout{k}]")
+        if i in mic_starts:
+            mic_trim = f"start={mic_starts[i] - mic_base}:end={mic_starts[i] - mic_base + end_time - start_time}"
+            filters.append(f"[a{k}]atrim={trim},asetpts=PTS-STARTPTS,volume={config['video_audio_volume']}[a0_{k}];"
+                           f"[m{mic_index}]atrim={mic_trim},asetpts=PTS-STARTPTS,volume={config['mic_audio_volume']}[a1_{k}];"
+                           f"[a0_{k}][a1_{k}]amix=inputs=2[aout{k}]")
+            mic_index += 1
         else:
-            # Video audio only
-            command += ['-ss', str(start_time), '-i', config['video_path'], '-t', str(duration),
-                        '-map', '0:v', '-map', '0:a', '-vf', 'yadif', '-c:v', vcodec] + extra_args + \
-                       ['-c:a', 'aac', '-b:a', '192k', output_filename]
+            filters.append(f"[a{k}]atrim={trim},asetpts=PTS-STARTPTS[aout{k}]")
+        # trim drops the stream's frame rate, so keep the source timestamps instead of resampling to 25 fps.
+        outputs += ['-map', f"[vout{k}]", '-map', f"[aout{k}]", '-fps_mode', 'passthrough', '-c:v', vcodec] + extra_args + \
+                   ['-c:a', 'aac', '-b:a', '192k', output_filename]
+
+    return command + ['-filter_complex', ';'.join(filters)] + outputs
 
-        run_ffmpeg_with_progress(command, duration, progress_callback)
+def encode_batch(config, jobs, gpu_args, update_status, encode_progress=None):
+    """Write the segments in jobs with one ffmpeg run (see build_batch_command)."""
+    numbers = ', '.join(str(i + 1) for i, *_ in jobs)
+    update_status(f"Encoding segments {numbers} of {os.path.basename(config['video_path'])} in one pass...")
+    command = build_batch_command(config, jobs, gpu_args)
+    key = ('batch', jobs[0][0])
+    # With several outputs, ffmpeg's time= is output time, which never exceeds the longest segment.
+    duration = max(job[2] - job[1] for job in jobs)
+    if encode_progress is not None:
+        encode_progress.add_job(key, duration)
+    try:
+        return run_ffmpeg_with_progress(command, duration,
+                                        encode_progress.job_callback(key) if encode_progress is not None else None)
+    finally:
+        if encode_progress is not None:
+            encode_progress.finish(key)
@@ -1,9 +1,14 @@
 import subprocess
+import bisect
+import tempfile
+import hashlib
+import json
 import os
+import re
 import sys
-import tempfile
 import shutil
 import imageio_ffmpeg
+import numpy as np
 from pathlib import Path
 from typing import List
 
@@ -20,86 +25,23 @@ def get_app_data_path(filename: str) -> Path:
     
     return base_path / filename
 
-def concatenate_videos(video_paths: List[str], output_path: str) -> bool:
+def file_fingerprint(path: str, chunk_size: int = 1 << 20) -> str:
     """
-    Concatenate multiple video files using FFmpeg's concat filter.
-    This method re-encodes the video and audio streams, resetting timestamps
-    to ensure a continuous timeline, which is crucial for subsequent processing.
+    Cheap identity of a media file: size, mtime and a hash of its first and last
+    chunk_size bytes. Used as a cache key without reading multi-GB files in full.
+    A VirtualTimeline concat list is identified by the files it lists, not by the list itself.
     """
-    if not video_paths:
-        return False
-    if len(video_paths) == 1:
-        # If only one file, just copy it to avoid re-encoding.
-        shutil.copy2(video_paths[0], output_path)
-        return True
-
-    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-    
-    # Build the input part of the command: -i file1 -i file2 ...
-    inputs = [arg for path in video_paths for arg in ['-i', path]]
-    
-    # Build the filter_complex part: [0:v][0:a][1:v][1:a]...concat=n=N:v=1:a=1[v][a]
-    filter_inputs = "".join([f"[{i}:v][{i}:a]" for i in range(len(video_paths))])
-    filter_complex = f"{filter_inputs}concat=n={len(video_paths)}:v=1:a=1[v][a]"
-
-    try:
-        command = [
-            ffmpeg_path, '-y',
-            *inputs,
-            '-filter_complex', filter_complex,
-            '-map', '[v]',
-            '-map', '[a]',
-            '-c:v', 'libx264', '-preset', 'medium', # Re-encode with standard settings
-            '-c:a', 'aac', '-b:a', '192k',
-            output_path
-        ]
-        
-        print("Running FFmpeg with concat filter...")
-        print(" ".join(command)) # For debugging
-
-        # Using STARTUPINFO to hide the console window on Windows
-        startupinfo = None
-        if os.name == 'nt':
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-
-        result = subprocess.run(command, capture_output=True, text=True, startupinfo=startupinfo)
-        
-        if result.returncode != 0:
-            print(f"Concatenation with filter failed. Error:\n{result.stderr}")
-            # Fallback to demuxer method if filter fails, as it's more robust for identical codecs
-            print("Falling back to concat demuxer (stream copy)...")
-            return _concatenate_with_demuxer(video_paths, output_path)
-            
-        print("Concatenation successful.")
-        return True
-    except Exception as e:
-        print(f"An exception occurred during concatenation: {e}")
-        return False
-
-def _concatenate_with_demuxer(video_paths: List[str], output_path: str) -> bool:
-    """Fallback to the faster but potentially problematic concat demuxer."""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as f:
-        for path in video_paths:
-            abs_path = os.path.abspath(path).replace("'", "'\\''")
-            f.write(f"file '{abs_path}'\n")
-        list_file = f.name
-    
-    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-    try:
-        command = [
-            ffmpeg_path, '-y', '-f', 'concat', '-safe', '0', '-i', list_file,
-            '-c', 'copy', output_path
-        ]
-        result = subprocess.run(command, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"Fallback concatenation failed: {result.stderr}")
-            return False
-        return True
-    finally:
-        if os.path.exists(list_file):
-            os.remove(list_file)
+    if is_concat_list(path):
+        sources = VirtualTimeline.load(path).paths
+        return hashlib.sha1('\n'.join(file_fingerprint(p, chunk_size) for p in sources).encode()).hexdigest()
+    stat = os.stat(path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(chunk_size))
+        if stat.st_size > chunk_size:
+            f.seek(max(chunk_size, stat.st_size - chunk_size))
+            digest.update(f.read(chunk_size))
+    return digest.hexdigest()
 
 def get_gpu_args() -> List[str]:
     """Detect if NVIDIA GPU is available and return appropriate ffmpeg args."""
@@ -107,4 +49,326 @@ def get_gpu_args() -> List[str]:
         subprocess.run(['nvidia-smi'], capture_output=True, check=True)
         return ['-c:v', 'h264_nvenc', '-preset', 'p4', '-tune', 'hq']
     except (subprocess.CalledProcessError, FileNotFoundError):
-        return ['-c:v', 'libx264', '-preset', 'medium']
\ No newline at end of file
+        return ['-c:v', 'libx264', '-preset', 'medium']
+
+def hidden_startupinfo():
+    """Return STARTUPINFO that hides the console window on Windows (None elsewhere)."""
+    if os.name != 'nt':
+        return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo.wShowWindow = subprocess.SW_HIDE
+    return startupinfo
+
+def probe_video(video_path: str) -> dict:
+    """
+    Read basic stream information from the header that the bundled ffmpeg prints.
+    imageio_ffmpeg does not ship ffprobe, so `ffmpeg -i` output is parsed instead.
+    Returns width, height, fps, duration, start_time, field_order, has_audio,
+    video_codec, video_profile and pix_fmt.
+    """
+    ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
+    result = subprocess.run([ffmpeg_path, '-hide_banner'] + ffmpeg_input_args(video_path),
+                            capture_output=True, text=True, encoding='utf-8', errors='replace',
+                            startupinfo=hidden_startupinfo())
+    header = result.stderr
+
+    info = {'width': None, 'height': None, 'fps': None, 'duration': None, 'start_time': 0.0,
+            'field_order': None, 'has_audio': bool(re.search(r"Stream #\S+.*: Audio:", header)),
+            'video_codec': None, 'video_profile': None, 'pix_fmt': None}
+
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", header)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    match = re.search(r"start: (-?\d+(?:\.\d+)?)", header)
+    if match:
+        info['start_time'] = float(match.group(1))
+
+    video_line = next((line for line in header.splitlines() if re.search(r"Stream #\S+.*: Video:", line)), None)
+    if video_line is None:
+        return info
+
+    match = re.search(r"Video: (\w+)(?: \(([^)]*)\))?.*?, (\w+)", video_line)
+    if match:
+        info['video_codec'], info['video_profile'], info['pix_fmt'] = match.groups()
+    match = re.search(r", (\d{2,5})x(\d{2,5})", video_line)
+    if match:
+        info['width'], info['height'] = int(match.group(1)), int(match.group(2))
+    match = re.search(r"([\d.]+)(k?) fps", video_line) or re.search(r"([\d.]+)(k?) tbr", video_line)
+    if match:
+        info['fps'] = float(match.group(1)) * (1000 if match.group(2) else 1)
+
+    if 'progressive' in video_line:
+        info['field_order'] = 'progressive'
+    elif re.search(r"top (coded )?first", video_line):
+        info['field_order'] = 'tt'
+    elif re.search(r"bottom (coded )?first", video_line):
+        info['field_order'] = 'bb'
+    return info
+
+# Extension of the concat lists written by VirtualTimeline. Any path with it is read through
+# ffmpeg's concat demuxer (see ffmpeg_input_args).
+CONCAT_LIST_SUFFIX = '.ffconcat'
+
+def is_concat_list(path: str) -> bool:
+    return str(path).lower().endswith(CONCAT_LIST_SUFFIX)
+
+def ffmpeg_input_args(path: str) -> List[str]:
+    """The ffmpeg input options for path: a plain -i, or the concat demuxer for a VirtualTimeline list."""
+    if is_concat_list(path):
+        return ['-f', 'concat', '-safe', '0', '-i', str(path)]
+    return ['-i', str(path)]
+
+class VirtualTimeline:
+    """
+    A recording split across several files (e.g. AVCHD's 2 GB chunks) played back to back.
+    Maps a global time to (file, local time) and writes an ffmpeg concat list, so the files can
+    be read as one video without joining them into a new file first.
+    """
+
+    def __init__(self, video_paths: List[str], durations: List[float] = None):
+        self.paths = [str(p) for p in video_paths]
+        if durations is None:
+            durations = [probe_video(path)['duration'] for path in self.paths]
+            missing = [path for path, duration in zip(self.paths, durations) if not duration]
+            if missing:
+                raise IOError(f"Could not read the duration of {missing[0]}")
+        self.durations = list(durations)
+        self.starts = [0.0]
+        for duration in self.durations[:-1]:
+            self.starts.append(self.starts[-1] + duration)
+        self.duration = sum(self.durations)
+
+    def locate(self, global_time: float):
+        """(file path, local time in that file) for a time on the joined timeline."""
+        index = max(0, bisect.bisect_right(self.starts, global_time) - 1)
+        return self.paths[index], global_time - self.starts[index]
+
+    def spans(self, start_time: float, end_time: float):
+        """The parts of [start_time, end_time) in each file, as (file path, local start, local end)."""
+        result = []
+        for path, file_start, duration in zip(self.paths, self.starts, self.durations):
+            local_start = max(start_time, file_start) - file_start
+            local_end = min(end_time, file_start + duration) - file_start
+            if local_end > local_start:
+                result.append((path, local_start, local_end))
+        return result
+
+    def source_range(self, start_time: float, end_time: float):
+        """(file path, local start, local end) when [start_time, end_time) lies in one file, else None."""
+        spans = self.spans(start_time, end_time)
+        return spans[0] if len(spans) == 1 else None
+
+    def write_concat_list(self, directory: str) -> str:
+        """
+        Write the concat list to directory and return its path, to be used wherever a video path is
+        expected. Durations are listed so ffmpeg can seek into later files without opening earlier ones.
+        """
+        key = hashlib.sha1('\n'.join(os.path.abspath(p) for p in self.paths).encode()).hexdigest()[:16]
+        list_path = os.path.join(directory, f"{os.path.basename(self.paths[0])}.timeline-{key}{CONCAT_LIST_SUFFIX}")
+        os.makedirs(directory, exist_ok=True)
+        with open(list_path, 'w', encoding='utf-8') as f:
+            f.write("ffconcat version 1.0\n")
+            for path, duration in zip(self.paths, self.durations):
+                escaped = Path(os.path.abspath(path)).as_posix().replace("'", "'\\''")
+                f.write(f"file '{escaped}'\nduration {duration:.6f}\n")
+        return list_path
+
+    @classmethod
+    def load(cls, list_path: str) -> 'VirtualTimeline':
+        """Rebuild the timeline from a concat list written by write_concat_list, without probing the files."""
+        paths = []
+        durations = []
+        with open(list_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('file '):
+                    paths.append(line[5:].strip()[1:-1].replace("'\\''", "'"))
+                elif line.startswith('duration '):
+                    durations.append(float(line[9:]))
+        return cls(paths, durations)
+
+def get_source_spans(video_path: str, start_time: float = 0.0, end_time: float = float('inf')):
+    """
+    The source files behind [start_time, end_time) of a video or VirtualTimeline list, as
+    (file path, local start, local end). Seeking through the concat demuxer is not sample-accurate
+    for audio (the encoder delay of AAC tracks is not trimmed), so audio and final encodes read
+    each file directly with these spans.
+    """
+    if is_concat_list(video_path):
+        return VirtualTimeline.load(video_path).spans(start_time, end_time)
+    return [(str(video_path), start_time, end_time)]
+
+def get_keyframe_times(video_path: str, cache_dir: str = None) -> List[float]:
+    """
+    Keyframe times of the first video stream in seconds, on the same timeline as ffmpeg's -ss
+    (i.e. relative to the file's start time). Uses an ffprobe packet scan when ffprobe is on PATH,
+    otherwise lets the bundled ffmpeg decode only keyframes (-skip_frame nokey) and reads showinfo.
+    With cache_dir the index is stored as JSON keyed by the file fingerprint.
+    """
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"{os.path.basename(video_path)}.keyframes-"
+                                              f"{hashlib.sha1(file_fingerprint(video_path).encode()).hexdigest()[:16]}.json")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable keyframe index {cache_path}: {e}")
+
+    ffprobe_path = shutil.which('ffprobe')
+    if ffprobe_path:
+        result = subprocess.run([ffprobe_path, '-v', 'error', '-select_streams', 'v:0',
+                                 '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0']
+                                + (['-f', 'concat', '-safe', '0'] if is_concat_list(video_path) else []) + [video_path],
+                                capture_output=True, text=True, startupinfo=hidden_startupinfo())
+        start_time = probe_video(video_path)['start_time']
+        times = []
+        for line in result.stdout.splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                times.append(float(pts_time) - start_time)
+    else:
+        result = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-nostats', '-skip_frame', 'nokey']
+                                + ffmpeg_input_args(video_path)
+                                + ['-map', '0:v:0', '-an', '-sn', '-vf', 'showinfo', '-f', 'null', '-'],
+                                capture_output=True, text=True, encoding='utf-8', errors='replace',
+                                startupinfo=hidden_startupinfo())
+        times = [float(t) for t in re.findall(r"pts_time:\s*(-?[\d.]+)", result.stderr)]
+    times = sorted(set(round(t, 6) for t in times))
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(times, f)
+    return times
+
+# How many times one field order must outnumber both the other order and the progressive count in
+# idet's verdict before a source is treated as interlaced. On progressive footage idet's counts split
+# roughly evenly between TFF and BFF, so a simple majority would deinterlace it.
+IDET_DOMINANCE = 3
+# Bump when the decision rule changes, so cached analyses made by the old rule are not reused.
+INTERLACE_ANALYSIS_VERSION = 2
+
+def analyze_interlacing(video_path: str, cache_dir: str = None, sample_seconds: float = 20) -> dict:
+    """
+    Decide whether a source needs deinterlacing. The field order in the stream header is often
+    wrong for camera footage, so sample_seconds from the middle of the video go through ffmpeg's
+    idet filter. One field order clearly dominating idet's multi-frame counts (IDET_DOMINANCE)
+    means interlaced; otherwise a progressive header or a progressive majority means progressive,
+    and the header decides the rest (e.g. a still picture). With cache_dir the result is stored as JSON keyed by the file fingerprint.
+    Returns {'interlaced', 'parity' ('tff', 'bff' or None), 'field_order', 'idet'}.
+    """
+    cache_path = None
+    if cache_dir:
+        key = hashlib.sha1(f"{file_fingerprint(video_path)}|v{INTERLACE_ANALYSIS_VERSION}".encode()).hexdigest()[:16]
+        cache_path = os.path.join(cache_dir, f"{os.path.basename(video_path)}.interlace-{key}.json")
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable interlace analysis {cache_path}: {e}")
+
+    info = probe_video(video_path)
+    start = max(0.0, (info['duration'] or 0) / 2 - sample_seconds / 2)
+    result = subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-nostats', '-ss', str(start),
+                             '-t', str(sample_seconds)] + ffmpeg_input_args(video_path) +
+                            ['-map', '0:v:0', '-an', '-sn', '-vf', 'idet', '-f', 'null', '-'],
+                            capture_output=True, text=True, encoding='utf-8', errors='replace',
+                            startupinfo=hidden_startupinfo())
+    counts = re.findall(r"Multi frame detection: TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)",
+                        result.stderr)
+    tff, bff, progressive = map(int, counts[-1]) if counts else (0, 0, 0)
+
+    dominant, other = max(tff, bff), min(tff, bff)
+    if dominant > 0 and dominant >= IDET_DOMINANCE * max(other, progressive):
+        interlaced = True
+        parity = 'tff' if tff > bff else 'bff'
+    elif info['field_order'] == 'progressive' or (tff + bff + progressive > 0 and progressive >= tff + bff):
+        interlaced, parity = False, None
+    else:
+        # idet is undecided (or nothing moved in the sample): trust the header, and deinterlace when it says nothing.
+        interlaced = True
+        parity = {'tt': 'tff', 'tb': 'tff', 'bb': 'bff', 'bt': 'bff'}.get(info['field_order'])
+    analysis = {'interlaced': interlaced, 'parity': parity, 'field_order': info['field_order'],
+                'idet': {'tff': tff, 'bff': bff, 'progressive': progressive}}
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(analysis, f)
+    return analysis
+
+def _audio_pcm_command(media_path: str, sample_rate: int, start: float = None, duration: float = None) -> List[str]:
+    command = [imageio_ffmpeg.get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-nostdin']
+    if start:
+        command += ['-ss', f"{start:.6f}"]
+    command += ffmpeg_input_args(media_path)
+    if duration is not None:
+        command += ['-t', f"{duration:.6f}"]
+    command += ['-vn', '-sn', '-ac', '1', '-ar', str(int(sample_rate)), '-f', 'f32le', 'pipe:1']
+    return command
+
+def extract_audio_pcm(media_path: str, sample_rate: int, start: float = None, duration: float = None) -> np.ndarray:
+    """
+    Decode the audio track of any media file (or a start/duration slice of it) straight into
+    a mono float32 array at sample_rate, piped from the bundled ffmpeg without temp files.
+    A VirtualTimeline list is decoded file by file.
+    """
+    if is_concat_list(media_path):
+        end = (start or 0.0) + duration if duration is not None else float('inf')
+        parts = [extract_audio_pcm(path, sample_rate, local_start, local_end - local_start)
+                 for path, local_start, local_end in get_source_spans(media_path, start or 0.0, end)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+    result = subprocess.run(_audio_pcm_command(media_path, sample_rate, start, duration),
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=hidden_startupinfo())
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to extract audio from {media_path}: "
+                           f"{result.stderr.decode('utf-8', errors='replace').strip()}")
+    data = result.stdout
+    return np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+
+def read_stderr_tail(stderr_file, max_lines: int = 5) -> str:
+    """Return the last few lines ffmpeg wrote to a temporary stderr file, for error messages."""
+    stderr_file.seek(0)
+    lines = stderr_file.read().decode('utf-8', errors='replace').strip().splitlines()
+    return '\n'.join(lines[-max_lines:])
+
+def iter_audio_blocks(media_path: str, sample_rate: int, block_size: int,
+                      start: float = None, duration: float = None):
+    """
+    Stream the audio track of any media file as mono float32 PCM at sample_rate,
+    decoded and resampled by the bundled ffmpeg, block_size samples at a time.
+    The last block may be shorter. A VirtualTimeline list is decoded file by file, so the last
+    block of each file may be shorter too.
+    """
+    if is_concat_list(media_path):
+        end = (start or 0.0) + duration if duration is not None else float('inf')
+        for path, local_start, local_end in get_source_spans(media_path, start or 0.0, end):
+            yield from iter_audio_blocks(path, sample_rate, block_size, local_start, local_end - local_start)
+        return
+    # stderr goes to a temporary file so a chatty decode can't fill the pipe and stall ffmpeg.
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(_audio_pcm_command(media_path, sample_rate, start, duration),
+                               stdout=subprocess.PIPE, stderr=stderr_file,
+                               startupinfo=hidden_startupinfo())
+    block_bytes = block_size * 4
+    try:
+        while True:
+            data = process.stdout.read(block_bytes)
+            if not data:
+                break
+            yield np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+        # A decode that dies part-way also ends the stream; don't let callers mistake it for the end of the file.
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode audio from {media_path} "
+                               f"(exit code {process.returncode}): {read_stderr_tail(stderr_file)}")
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        stderr_file.close()
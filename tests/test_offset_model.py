@@ -0,0 +1,32 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from cvcutter.video_processor import fit_offset_model
+
+
+def test_agreeing_segments_give_their_offset():
+    model = fit_offset_model([0, 100, 200], [3.5, 3.5, 3.5], [10.0, 10.0, 10.0])
+
+    assert model.intercept == pytest.approx(3.5)
+    assert model.inliers == 3
+
+
+def test_zero_weights_fall_back_to_the_median():
+    # No cluster carries any weight, so the consensus picks no inliers.
+    model = fit_offset_model([0, 100], [5.0, 9.0], [0.0, 0.0])
+
+    assert model.intercept == pytest.approx(7.0)
+    assert model.drift == 0.0
+    assert model.inliers == 0
+    assert str(model)
+
+
+def test_zero_weighted_outliers_do_not_raise():
+    model = fit_offset_model([0, 100, 200], [1.0, 5.0, 9.0], [0.0, 0.0, 0.0])
+
+    assert model.intercept == pytest.approx(5.0)
+    assert str(model)
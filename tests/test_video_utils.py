@@ -0,0 +1,23 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import imageio_ffmpeg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from cvcutter.video_utils import analyze_interlacing
+
+
+def test_progressive_testsrc2_is_not_interlaced(tmp_path):
+    # idet splits testsrc2's motion roughly evenly between TFF and BFF; that must not count as interlaced.
+    clip = tmp_path / "progressive.mp4"
+    subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), '-v', 'error', '-y', '-f', 'lavfi',
+                    '-i', 'testsrc2=size=320x240:rate=25', '-t', '12',
+                    '-c:v', 'libx264', '-pix_fmt', 'yuv420p', str(clip)], check=True)
+
+    analysis = analyze_interlacing(str(clip))
+
+    assert analysis['field_order'] == 'progressive'
+    assert analysis['interlaced'] is False
+    assert analysis['parity'] is None